@@ -1,6 +1,8 @@
 import random
-import copy
+from collections import OrderedDict
+from multiprocessing import shared_memory
 
+import numpy as np
 import pandas as pd
 
 def split_train_test(records, test_perc=90, seed=None):
@@ -16,10 +18,313 @@ def split_train_test(records, test_perc=90, seed=None):
     return records[:n_train], records[n_train:]
 
 def apply_gen(records, gen_state, gen_rules):
-    """ Apply to some records the state of a generalization node """
-    gen_records = copy.deepcopy(records)
-    for r in gen_records:
-        for col, gen_level in gen_state.items():
-            r[col] = gen_rules[col].apply(r[col], gen_level)
+    """ Apply to some records the state of a generalization node. Rows are copied shallowly: only the
+    generalized cells are new """
+    gen_records = [list(r) for r in records]
+    for col, gen_level in gen_state.items():
+        apply = gen_rules[col].apply
+        for r in gen_records:
+            r[col] = apply(r[col], gen_level)
 
-    return gen_records
\ No newline at end of file
+    return gen_records
+
+
+# Largest number of equivalence classes that can be told apart by a packed key
+MAX_RADIX = 2**62
+# Equivalence classes are counted with a histogram over all possible keys when there are at most this many
+# possible keys per record, otherwise by sorting keys
+DENSE_COUNT_FACTOR = 4
+# Most recently used frequency sets kept by a dataset to roll up the classes of more general states
+FREQUENCY_SET_CACHE = 256
+
+class EncodedDataset():
+    """ Columnar, dictionary-encoded records: every column is an array of integer codes into the list of
+    its distinct values. Quasi-identifiers are generalized directly on their codes, through the lookup
+    tables of their generalization rules """
+    def __init__(self, records, gen_rules):
+        self.gen_rules = gen_rules
+        self.size = len(records)
+        self.width = len(records[0]) if self.size > 0 else 0
+        self.codes = []
+        self.values = []
+        for col in range(self.width):
+            codes, values = encode_column([r[col] for r in records])
+            self.codes.append(codes)
+            self.values.append(values)
+
+        self._tables = {}
+        self._level_maps = {}
+        self._value_counts = {}
+        self.frequency_sets = OrderedDict()
+
+    def __len__(self):
+        return self.size
+
+    def share(self):
+        """ Copy the codes of the quasi-identifiers to a block of shared memory. Returns the block, to be released
+        by the caller, and a description of the dataset other processes can attach to """
+        qis = self.qis
+        block = shared_memory.SharedMemory(create=True, size=max(1, 4 * len(qis) * self.size))
+        codes = np.ndarray((len(qis), self.size), dtype=np.int32, buffer=block.buf)
+        for i, col in enumerate(qis):
+            codes[i] = self.codes[col]
+
+        return block, {
+            'name': block.name,
+            'size': self.size,
+            'width': self.width,
+            'values': {col: self.values[col] for col in qis},
+        }
+
+    @classmethod
+    def attach(cls, shared, gen_rules):
+        """ Dataset of the quasi-identifiers whose codes are in a block of shared memory (see share) """
+        dataset = cls([], gen_rules)
+        dataset.block = shared_memory.SharedMemory(name=shared['name'])
+        dataset.size = shared['size']
+        dataset.width = shared['width']
+        codes = np.ndarray((len(dataset.qis), dataset.size), dtype=np.int32, buffer=dataset.block.buf)
+        dataset.codes = [None] * dataset.width
+        dataset.values = [None] * dataset.width
+        for i, col in enumerate(dataset.qis):
+            dataset.codes[col] = codes[i]
+            dataset.values[col] = shared['values'][col]
+
+        return dataset
+
+    @property
+    def qis(self):
+        return list(self.gen_rules.keys())
+
+    def table(self, col, gen_level):
+        """ Lookup table from the codes of a column to the codes of its generalization at some level, with the
+        values the generalized codes stand for """
+        if (col, gen_level) not in self._tables:
+            self._tables[(col, gen_level)] = self.gen_rules[col].code_table(self.values[col], gen_level)
+
+        return self._tables[(col, gen_level)]
+
+    def generalize(self, col, gen_level):
+        """ Codes of a column generalized to some level, with the values they stand for """
+        table, domain = self.table(col, gen_level)
+        return table[self.codes[col]], domain
+
+    def value_counts(self, col, gen_level=None):
+        """ Number of records with each original value of a column, or each value of its generalization to some
+        level, computed from the counts of the original values """
+        if (col, None) not in self._value_counts:
+            self._value_counts[(col, None)] = np.bincount(self.codes[col], minlength=len(self.values[col]))
+        if (col, gen_level) not in self._value_counts:
+            table, domain = self.table(col, gen_level)
+            counts = np.bincount(table, weights=self._value_counts[(col, None)], minlength=len(domain))
+            self._value_counts[(col, gen_level)] = counts.astype(np.int64)
+
+        return self._value_counts[(col, gen_level)]
+
+    def class_keys(self, gen_state):
+        """ Pack the generalized quasi-identifiers of every record into a single int64 (see pack_keys) """
+        generalized = [self.generalize(col, gen_level) for col, gen_level in gen_state.items()]
+        return pack_keys([codes for codes, _ in generalized], [len(domain) for _, domain in generalized])
+
+    def level_map(self, col, from_level, to_level):
+        """ Lookup table from the codes of a column at some level to its codes at a higher level, or None if the
+        rule is not a hierarchy, i.e.: a generalized value does not determine its further generalizations """
+        if (col, from_level, to_level) not in self._level_maps:
+            from_table, from_domain = self.table(col, from_level)
+            to_table, _ = self.table(col, to_level)
+            level_map = np.zeros(len(from_domain), dtype=np.int32)
+            level_map[from_table] = to_table
+            if not np.array_equal(level_map[from_table], to_table):
+                level_map = None
+            self._level_maps[(col, from_level, to_level)] = level_map
+
+        return self._level_maps[(col, from_level, to_level)]
+
+    def frequency_set(self, gen_state):
+        """ Equivalence classes of the records generalized according to a state. They are rolled up from the
+        classes of the smallest cached state one level less general in some quasi-identifier, if any, instead of
+        rescanning the records. Only the FREQUENCY_SET_CACHE most recently used states are kept """
+        levels = tuple(gen_state[col] for col in self.qis)
+        if levels in self.frequency_sets:
+            self.frequency_sets.move_to_end(levels)
+            return self.frequency_sets[levels]
+
+        frequency_set = None
+        predecessors = [levels[:i] + (level - 1,) + levels[i + 1:] for i, level in enumerate(levels) if level > 0]
+        predecessors = [self.frequency_sets[p] for p in predecessors if p in self.frequency_sets]
+        for predecessor in sorted(predecessors, key=lambda fs: len(fs.counts)):
+            frequency_set = self.roll_up(predecessor, levels)
+            if frequency_set is not None:
+                break
+
+        if frequency_set is None:
+            frequency_set = self.scan(levels)
+
+        self.frequency_sets[levels] = frequency_set
+        if len(self.frequency_sets) > FREQUENCY_SET_CACHE:
+            self.frequency_sets.popitem(last=False)
+        return frequency_set
+
+    def scan(self, levels, weights=None):
+        """ Equivalence classes at some levels, counted over all the records (see FrequencySet.count for
+        weights) """
+        codes = np.stack([self.generalize(col, level)[0] for col, level in zip(self.qis, levels)], axis=1)
+        domains = [self.table(col, level)[1] for col, level in zip(self.qis, levels)]
+        return FrequencySet.count(levels, codes, domains, weights=weights)
+
+    def roll_up(self, frequency_set, levels):
+        """ Equivalence classes at some levels, merged from the classes of a less general state """
+        codes = np.empty_like(frequency_set.codes)
+        for i, (col, from_level, to_level) in enumerate(zip(self.qis, frequency_set.levels, levels)):
+            level_map = self.level_map(col, from_level, to_level)
+            if level_map is None:
+                return None
+            codes[:, i] = level_map[frequency_set.codes[:, i]]
+
+        domains = [self.table(col, level)[1] for col, level in zip(self.qis, levels)]
+        return FrequencySet.count(levels, codes, domains, weights=frequency_set.counts)
+
+    def class_sizes(self, gen_state):
+        """ Size of every equivalence class of the records generalized according to a state """
+        return self.frequency_set(gen_state).counts
+
+    def decode(self, gen_state=None, columns=None, rows=None):
+        """ Turn the dataset back into a list of lists, generalized according to a generalization state. Only
+        some columns can be materialized, leaving the others to None, and only some rows """
+        if gen_state is None:
+            gen_state = {}
+        if columns is None:
+            columns = range(self.width)
+        if rows is None:
+            rows = slice(None)
+
+        size = len(self.codes[0][rows]) if self.width > 0 else 0
+        materialized = [[None] * size] * self.width
+        for col in columns:
+            if col in gen_state:
+                table, domain = self.table(col, gen_state[col])
+                codes = table[self.codes[col][rows]]
+            else:
+                codes, domain = self.codes[col][rows], self.values[col]
+            materialized[col] = object_array(domain)[codes].tolist()
+
+        return [list(r) for r in zip(*materialized)]
+
+    def project(self, gen_state=None):
+        """ Records reduced to their quasi-identifiers, all other columns being None """
+        return self.decode(gen_state, columns=self.qis)
+
+    def release(self, gen_state, k):
+        """ Records to release for a generalization state, suppressing the equivalence classes smaller than k.
+        Records are grouped by class, classes coming in order of first appearance. Returns the indices of the
+        records to release and the sizes of all classes """
+        keys, _ = self.class_keys(gen_state)
+        _, first, inverse, sizes = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+
+        class_order = np.argsort(np.argsort(first))
+        order = np.argsort(class_order[inverse], kind='stable')
+        kept = order[sizes[inverse[order]] >= k]
+
+        return kept, sizes
+
+class FrequencySet():
+    """ Equivalence classes of a generalization: the generalized codes of every class, one column per
+    quasi-identifier, and the number of records in it """
+    def __init__(self, levels, codes, counts):
+        self.levels = levels
+        self.codes = codes
+        self.counts = counts
+
+    @classmethod
+    def count(cls, levels, codes, domains, weights=None):
+        """ Group rows of generalized codes, each standing for some records (one if no weights). With a matrix
+        of weights, i.e.: a column of weights for each of several samples of the records, the counts are a
+        matrix of classes x samples """
+        keys, radix = pack_keys(codes.T, [len(domain) for domain in domains])
+
+        if radix <= DENSE_COUNT_FACTOR * len(keys):
+            counts = np.bincount(keys, minlength=radix)
+            present = np.flatnonzero(counts)
+            inverse = np.searchsorted(present, keys)
+            counts = counts[present]
+        else:
+            present, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(present))
+
+        if weights is not None:
+            counts = sum_groups(inverse, np.asarray(weights), len(present))
+
+        # All the rows of a class have the same codes: any of them can represent it
+        representative = np.empty(len(present), dtype=np.int64)
+        representative[inverse] = np.arange(len(keys))
+
+        return cls(levels, codes[representative], counts.astype(np.int64))
+
+    def generalizes_to(self, levels):
+        return all(a <= b for a, b in zip(self.levels, levels))
+
+
+def sum_groups(groups, weights, num_groups):
+    """ Sum of the weights of the rows of every group, for every column if the weights are a matrix """
+    if weights.ndim == 1:
+        return np.bincount(groups, weights=weights, minlength=num_groups)
+
+    columns = weights.shape[1]
+    cells = (groups[:, None] * columns + np.arange(columns)).ravel()
+    return np.bincount(cells, weights=weights.ravel(), minlength=num_groups * columns).reshape(num_groups, columns)
+
+
+def pack_keys(columns, radices):
+    """ Pack columns of codes into a single int64 per row, in mixed radix. Returns the keys and the number of
+    possible keys """
+    keys = np.zeros(len(columns[0]) if len(columns) > 0 else 0, dtype=np.int64)
+    radix = 1
+    for codes, size in zip(columns, radices):
+        if radix * size > MAX_RADIX:
+            # Too many combinations to pack: renumber the ones actually present
+            present, keys = np.unique(keys, return_inverse=True)
+            radix = len(present)
+        keys = keys * size + codes
+        radix *= size
+
+    return keys, radix
+
+def encode_column(values):
+    """ Dictionary-encode a column: codes, in order of first appearance, and the values they stand for """
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+def object_array(values):
+    """ Numpy array of arbitrary Python objects, which are never unpacked (e.g.: tuples) """
+    array = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        array[i] = v
+    return array
+
+def encode(records, gen_rules):
+    """ Encode records for some generalization rules, unless they already are """
+    if isinstance(records, EncodedDataset):
+        if records.gen_rules is gen_rules:
+            return records
+        records = records.decode()
+
+    return EncodedDataset(records, gen_rules)
+
+
+def suppressed(class_sizes, k):
+    """ Number of records to suppress to make some equivalence classes k-anonymous, for every sample if the
+    class sizes are a matrix of classes x samples """
+    if class_sizes.ndim == 2:
+        return np.where(class_sizes < k, class_sizes, 0).sum(axis=0)
+    return int(class_sizes[class_sizes < k].sum())
+
+
+def pack_masks(masks):
+    """ Store samples of the records, given as a boolean matrix of samples x records, in a bit array """
+    masks = np.asarray(masks, dtype=bool)
+    return np.packbits(masks, axis=1), masks.shape[1]
+
+
+def unpack_masks(packed, size):
+    return np.unpackbits(packed, axis=1, count=size).astype(bool)
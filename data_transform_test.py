@@ -0,0 +1,126 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import data_transform as dt
+import quasi_identifiers as qi
+
+records = [
+    ['39', 'State-gov', 'Bachelors', 'Never-married', '<=50K'],
+    ['50', 'Self-emp-not-inc', 'Bachelors', 'Married-civ-spouse', '<=50K'],
+    ['38', 'Private', 'HS-grad', 'Divorced', '<=50K'],
+    ['53', 'Private', '11th', 'Married-civ-spouse', '>50K'],
+    ['28', 'Private', 'Bachelors', 'Married-civ-spouse', '<=50K'],
+    ['37', 'Private', 'Masters', 'Married-civ-spouse', '>50K'],
+]
+
+gen_rules = {
+    0: qi.generalize_age_rule,
+    1: qi.adult_generalize_workclass_rule,
+    3: qi.adult_generalize_marital_status_rule,
+}
+
+class TestEncodedDataset(unittest.TestCase):
+    def test_encode(self):
+        dataset = dt.encode(records, gen_rules)
+        self.assertEqual(len(dataset), 6)
+        self.assertEqual(list(dataset.codes[1]), [0, 1, 2, 2, 2, 2])
+        self.assertEqual(dataset.values[1], ['State-gov', 'Self-emp-not-inc', 'Private'])
+        self.assertIs(dt.encode(dataset, gen_rules), dataset)
+
+    def test_decode(self):
+        dataset = dt.encode(records, gen_rules)
+        self.assertEqual(dataset.decode(), records)
+
+    def test_decode_generalized(self):
+        dataset = dt.encode(records, gen_rules)
+        for gen_state in [{0: 1, 1: 0, 3: 2}, {0: 2, 1: 1, 3: 1}, {0: 0, 1: 2, 3: 0}]:
+            self.assertEqual(dataset.decode(gen_state), dt.apply_gen(records, gen_state, gen_rules))
+
+    def test_class_sizes(self):
+        dataset = dt.encode(records, gen_rules)
+        self.assertEqual(sorted(dataset.class_sizes({0: 3, 1: 1, 3: 2})), [1, 1, 4])
+        self.assertEqual(sorted(dataset.class_sizes({0: 1, 1: 2, 3: 2})), [1, 2, 3])
+
+    def test_class_sizes_many_combinations(self):
+        dataset = dt.encode(records, gen_rules)
+        max_radix = dt.MAX_RADIX
+        dt.MAX_RADIX = 4
+        try:
+            self.assertEqual(sorted(dataset.class_sizes({0: 0, 1: 0, 3: 0})), [1] * 6)
+            self.assertEqual(sorted(dataset.class_sizes({0: 3, 1: 1, 3: 2})), [1, 1, 4])
+        finally:
+            dt.MAX_RADIX = max_radix
+
+    def test_suppressed(self):
+        dataset = dt.encode(records, gen_rules)
+        self.assertEqual(dt.suppressed(dataset.class_sizes({0: 1, 1: 2, 3: 2}), 3), 3)
+
+    def test_frequency_set_roll_up(self):
+        from itertools import product
+        states = [dict(zip(gen_rules, levels)) for levels in product(range(4), range(3), range(3))]
+        scanned = [sorted(dt.encode(records, gen_rules).class_sizes(state)) for state in states]
+        dataset = dt.encode(records, gen_rules)
+        dataset.frequency_set({0: 0, 1: 0, 3: 0})
+        self.assertEqual([sorted(dataset.class_sizes(state)) for state in states], scanned)
+
+    def test_frequency_set_cache(self):
+        dataset = dt.encode(records, gen_rules)
+        bottom = dataset.frequency_set({0: 0, 1: 0, 3: 0})
+        with mock.patch.object(dataset, 'scan', side_effect=AssertionError('scanned')):
+            # rolled up from the cached predecessor
+            dataset.frequency_set({0: 1, 1: 0, 3: 0})
+        with mock.patch.object(dt, 'FREQUENCY_SET_CACHE', 2):
+            dataset.frequency_set({0: 1, 1: 1, 3: 0})
+        self.assertEqual(list(dataset.frequency_sets), [(1, 0, 0), (1, 1, 0)])
+        self.assertIsNot(dataset.frequency_set({0: 0, 1: 0, 3: 0}), bottom)
+
+    def test_frequency_set_not_hierarchy(self):
+        # odd ages at the first level, but not at the second
+        rule = qi.GeneralizationRule(lambda v, l: v if l == 0 else (int(v) % 2 if l == 1 else int(v) % 3), 2)
+        dataset = dt.encode(records, {0: rule})
+        dataset.frequency_set({0: 1})
+        self.assertIsNone(dataset.level_map(0, 1, 2))
+        self.assertEqual(sorted(dataset.class_sizes({0: 2})), [1, 2, 3])
+
+    def test_project(self):
+        dataset = dt.encode(records, gen_rules)
+        projection = dataset.project({0: 3, 1: 1, 3: 2})
+        self.assertEqual(projection[1], [(0, 129), 'Self-Employed', None, 'Human', None])
+
+    def test_release(self):
+        dataset = dt.encode(records, gen_rules)
+        gen_state = {0: 1, 1: 2, 3: 2}
+        released, sizes = dataset.release(gen_state, 2)
+        # the 30s come first, then the 50s, while the only 20-something is suppressed
+        self.assertEqual(list(released), [0, 2, 5, 1, 3])
+        self.assertEqual(sorted(sizes), [1, 2, 3])
+        self.assertEqual(dataset.decode(gen_state, rows=released)[2], [(30, 39), 'Workforce', 'Masters', 'Human', '>50K'])
+
+    def test_class_sizes_per_sample(self):
+        dataset = dt.encode(records, gen_rules)
+        masks = np.array([[1, 1, 0, 1, 1, 1], [0, 1, 1, 1, 0, 1]], dtype=bool)
+        frequency_set = dataset.scan((3, 1, 2), weights=masks.T.astype(np.int64))
+        self.assertEqual(frequency_set.counts.shape, (3, 2))
+        self.assertEqual(sorted(frequency_set.counts[:, 0]), [1, 1, 3])
+        self.assertEqual(sorted(frequency_set.counts[:, 1]), [0, 1, 3])
+        self.assertEqual(list(dt.suppressed(frequency_set.counts, 2)), [2, 1])
+        packed, size = dt.pack_masks(masks)
+        self.assertTrue((dt.unpack_masks(packed, size) == masks).all())
+
+    def test_share(self):
+        dataset = dt.encode(records, gen_rules)
+        block, shared = dataset.share()
+        try:
+            attached = dt.EncodedDataset.attach(shared, gen_rules)
+            for gen_state in [{0: 1, 1: 0, 3: 2}, {0: 3, 1: 1, 3: 2}]:
+                self.assertEqual(sorted(attached.class_sizes(gen_state)), sorted(dataset.class_sizes(gen_state)))
+            attached.block.close()
+        finally:
+            block.close()
+            block.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
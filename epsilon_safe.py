@@ -1,105 +1,274 @@
-import decimal
-
 import numpy as np
+from scipy.special import logsumexp
 from scipy.stats import binom
 
-import experiment
 import information_loss
 
 def get_beta(epsilon_prime, epsilon):
     beta  = 1 - np.exp(epsilon_prime - epsilon)
     return beta
 
-def parameters(k, beta, epsilon, size_d):
+# Number of values of n whose tails are computed at once in big_d
+BIG_D_CHUNK = 4096
+
+def big_d(k, beta, epsilon, size_d, tolerance=0):
+    """ Largest probability, over the sizes n of an equivalence class of at least k/gamma - 1 records and at most
+    size_d, that a Bernoulli(beta) sample keeps at least gamma * n of its records.
+
+    Every tail is a single binomial survival function, computed for many n at once. By Hoeffding's inequality
+    the tail at n is at most exp(-2n(gamma - beta)^2), which decreases with n: the search stops once this bound
+    is below the largest tail found plus some tolerance, so that the result is exact with no tolerance and
+    otherwise underestimates by at most the tolerance """
+    gamma = (np.exp(epsilon) - 1 + beta) / (np.exp(epsilon))
+    n_min = int(np.ceil((k/gamma) - 1))
+    gap = gamma - beta
+
+    maxim = 0
+    start, end = n_min, size_d + 1
+    while start < end:
+        n = np.arange(start, min(start + BIG_D_CHUNK, end))
+        tails = binom.sf(np.ceil(gamma*n) - 1, n, beta)
+        maxim = max(maxim, float(tails.max()))
+        start = n[-1] + 1
+
+        if gap > 0 and maxim + tolerance > 0:
+            end = min(end, int(np.ceil(np.log(1 / (maxim + tolerance)) / (2 * gap**2))))
+
+    return maxim
+
+def parameters(k, beta, epsilon, size_d, tolerance=0):
     """ Compute epsilon' AND the associated delta for a k """
     epsilon_prime = np.log(1-beta) + epsilon
     if epsilon_prime <= 0:
         return None, None # Try again, with higher epsilon or lower beta
 
-    def big_d(k, beta, epsilon):
-        gamma = (np.exp(epsilon) - 1 + beta) / (np.exp(epsilon))
-        n_min = int(np.ceil((k/gamma) - 1))
+    return epsilon_prime, big_d(k, beta, epsilon-epsilon_prime, size_d, tolerance=tolerance)
+
+
+
+
+def min_epsilon(beta):
+    """ Epsilon that must be exceeded for epsilon' to be positive with some beta """
+    return -np.log(1 - beta)
+
+def max_beta(epsilon):
+    """ Beta that must not be reached for epsilon' to be positive with some epsilon """
+    return 1 - np.exp(-epsilon)
+
+
+class DeltaCurve():
+    """ Delta as a function of beta, for some k and dataset size. It does not depend on epsilon, which only
+    needs to exceed min_epsilon(beta), and it is not monotone in beta, as the tails jump with ceil(gamma n).
+    Values are cached """
+    def __init__(self, k, size_d, tolerance=0):
+        self.k = k
+        self.size_d = size_d
+        self.tolerance = tolerance
+        self.values = {}
+
+    def __call__(self, beta):
+        beta = float(beta)
+        if beta not in self.values:
+            self.values[beta] = big_d(self.k, beta, min_epsilon(beta), self.size_d, tolerance=self.tolerance)
+        return self.values[beta]
+
 
-        maxim = 0
-        c = 0
-        for n in range(n_min, size_d):
-            c += 1
-            summ = 0
-            for j in range(int(np.ceil(gamma*n)), n+1):
-                summ += binom.pmf(j, n, beta)
+def frontier(k, size_d, delta, betas, epsilons=None, tolerance=0, beta_tolerance=1e-4):
+    """ Feasible configurations for a target delta. Returns, for every beta of a grid, its delta, the epsilon
+    it needs to exceed and whether its delta is at most the target; and for every epsilon the largest feasible
+    beta (nan if none). The latter is the largest feasible beta of the grid, refined by bisection up to the next
+    beta of the grid, keeping a feasible lower bound: as delta is not monotone, it can miss a feasible beta
+    past an unfeasible one within a cell of the grid """
+    curve = DeltaCurve(k, size_d, tolerance=tolerance)
+    betas = np.sort(np.asarray(betas, dtype=np.float64))
 
-            if maxim < summ:
-                maxim = summ
-                        
-            if c == 50: # estimate D to make evaluation tractable
-                break
+    by_beta = np.zeros(len(betas), dtype=[('beta', np.float64), ('delta', np.float64),
+        ('min_epsilon', np.float64), ('feasible', bool)])
+    by_beta['beta'] = betas
+    by_beta['delta'] = [curve(beta) for beta in betas]
+    by_beta['min_epsilon'] = min_epsilon(betas)
+    by_beta['feasible'] = by_beta['delta'] <= delta
 
-        return maxim
-    
-    return epsilon_prime, big_d(k, beta, epsilon-epsilon_prime)
-        
+    if epsilons is None:
+        return by_beta, None
 
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    by_epsilon = np.zeros(len(epsilons), dtype=[('epsilon', np.float64), ('max_beta', np.float64),
+        ('delta', np.float64)])
+    by_epsilon['epsilon'] = epsilons
+    for row in by_epsilon:
+        cap = max_beta(row['epsilon'])
+        feasible = lambda beta: beta < cap and curve(beta) <= delta
 
+        candidates = np.flatnonzero(by_beta['feasible'] & (betas < cap))
+        if len(candidates) == 0:
+            row['max_beta'] = row['delta'] = np.nan
+            continue
+
+        i = candidates[-1]
+        low, high = betas[i], betas[i + 1] if i + 1 < len(betas) else 1
+        while high - low > beta_tolerance:
+            middle = (low + high) / 2
+            if feasible(middle):
+                low = middle
+            else:
+                high = middle
+        row['max_beta'] = low
+        row['delta'] = curve(low)
+
+    return by_beta, by_epsilon
+
+
+# Fields of output_stats, in the order of its tuple
+STATS_DTYPE = np.dtype([
+    ('average_info_loss', np.float64),
+    ('min_suppression', np.float64),
+    ('max_suppression', np.float64),
+    ('average_suppression', np.float64),
+    ('baseline_suppression', np.float64),
+    ('good_nodes', np.float64),
+    ('baseline_good_nodes', np.float64),
+])
+
+def distribution_stats(nodes, p, max_sup=None, max_info_loss=None):
+    """ output_stats of every distribution p (..., nodes) over the nodes of a lattice (see epsilon_safe_ola.run),
+    or of stacked lattices (..., nodes) with matching distributions. Returns a structured array of STATS_DTYPE
+    with the shape of p without its last axis """
+    suppression = np.asarray(nodes['suppression'], dtype=np.float64)
+    info_loss = np.asarray(nodes['info_loss'], dtype=np.float64)
+    good = (suppression <= max_sup) & (info_loss <= max_info_loss)
+
+    stats = np.zeros(p.shape[:-1], dtype=STATS_DTYPE)
+    stats['average_info_loss'] = (p * info_loss).sum(axis=-1)
+    stats['min_suppression'] = np.minimum(suppression.min(axis=-1), 100)
+    stats['max_suppression'] = np.maximum(suppression.max(axis=-1), 0)
+    # the suppression of good nodes is counted twice
+    stats['average_suppression'] = (p * suppression * (1 + good)).sum(axis=-1)
+    stats['baseline_suppression'] = suppression.mean(axis=-1)
+    stats['good_nodes'] = (p * good).sum(axis=-1)
+    stats['baseline_good_nodes'] = good.mean(axis=-1)
+
+    return stats
 
 def output_stats(nodes, max_sup=None, max_info_loss=None):
     """ Takes a distribution over output nodes and computes some probabilistic stats """
-    average_info_loss = 0
+    stats = distribution_stats(nodes, nodes['p'], max_sup=max_sup, max_info_loss=max_info_loss)
+    return tuple(stats[name].item() for name in STATS_DTYPE.names)
 
-    average_suppression = 0
-    baseline_suppression = experiment.AverageMeter()
-    min_suppression = 100
-    max_suppression = 0
 
-    good_nodes = 0
-    baseline_good_nodes = 0
+class ExponentialMechanism():
+    """ Exponential mechanism over some outputs: each is sampled with a probability proportional to
+    exp(epsilon * utility / (2 * sensitivity)). Probabilities are normalized in log space, so that large
+    utilities do not overflow """
+    def __init__(self, epsilon, utilities, sensitivity):
+        scores = epsilon * np.asarray(utilities, dtype=np.float64) / (2 * sensitivity)
+        self.log_p = scores - logsumexp(scores)
+        self.p = np.exp(self.log_p)
+        self.cumulative = np.cumsum(self.p)
 
-    for node in nodes:
-        p = node['p']
+    def sample(self, n=None, rng=None):
+        """ Indices of n outputs drawn independently (a single index if n is None) """
+        if rng is None:
+            rng = np.random.default_rng()
 
-        average_info_loss += p * node['info_loss']
+        # the cumulative probabilities may not quite reach 1
+        draws = rng.random(n) * self.cumulative[-1]
+        return np.minimum(np.searchsorted(self.cumulative, draws, side='right'), len(self.cumulative) - 1)
 
-        average_suppression += p * node['suppression']
-        baseline_suppression.add(node['suppression'])
-        min_suppression = min(min_suppression, node['suppression'])
-        max_suppression = max(max_suppression, node['suppression'])
-        
-        if node['suppression'] <= max_sup and node['info_loss'] <= max_info_loss:
-            average_suppression += p * node['suppression']
-            baseline_good_nodes += 1
-            good_nodes += node['p']
+def _chain_variances(traces):
+    """ Within-chain variance and pooled estimate of the variance of some chains (chains x draws) of a scalar """
+    n = traces.shape[1]
+    within = traces.var(axis=1, ddof=1).mean()
+    between = traces.mean(axis=1).var(ddof=1) if len(traces) > 1 else 0
+    return within, (n - 1) / n * within + between
 
-    baseline_good_nodes /= len(nodes)
+def r_hat(traces):
+    """ Potential scale reduction of some chains (chains x draws) of a scalar, every chain split in halves so
+    that trends within a chain count as well. Close to 1 once the chains have mixed """
+    traces = np.asarray(traces, dtype=np.float64)
+    half = traces.shape[1] // 2
+    split = np.concatenate([traces[:, :half], traces[:, half:2 * half]])
+    within, pooled = _chain_variances(split)
+    if within == 0:
+        # chains stuck at different values never mix
+        return np.inf if pooled > 0 else np.nan
+    return float(np.sqrt(pooled / within))
 
-    return average_info_loss, min_suppression, max_suppression, average_suppression, baseline_suppression.get(), good_nodes, baseline_good_nodes
+def effective_sample_size(traces):
+    """ Number of independent draws worth as much as some chains (chains x draws) of a scalar: their
+    autocorrelation is summed over pairs of lags until a pair is negative (Geyer's initial positive sequence) """
+    traces = np.asarray(traces, dtype=np.float64)
+    chains, n = traces.shape
+    within, pooled = _chain_variances(traces)
+    if pooled == 0:
+        return np.nan
 
+    # autocovariance of every chain at every lag, with an FFT
+    centered = traces - traces.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(centered, n=2 * n, axis=1)
+    autocovariance = np.fft.irfft(spectrum * np.conj(spectrum), axis=1)[:, :n] / n
+    rho = 1 - (within - autocovariance.mean(axis=0)) / pooled
+    rho[0] = 1
 
-def exp_mechanism(epsilon, utility, sensitivity):
-    large = decimal.Decimal((epsilon * utility / (2 * sensitivity)))
-    return np.exp(large)
+    pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+    negative = np.flatnonzero(pairs < 0)
+    if len(negative) > 0:
+        pairs = pairs[:negative[0]]
+    # as in Stan, anticorrelated chains are not credited with more than log10 of their draws times theirs
+    tau = max(-1 + 2 * pairs.sum(), 1 / np.log10(chains * n))
+    return float(chains * n / tau)
 
-def compute_utility(nodes, epsilon, penalty_factor, max_penalty, sensitivity, mode, gen_rules):
-    """ Enrich list representing the nodes in a lattice with their utility and probability of being
-    sampled by the exponential mechanism """
-    penalty_prec = information_loss.make_penalty_prec(penalty_factor, max_penalty).compute
+def utility(nodes, penalty_factor, mode, gen_rules, max_penalty=None):
+    """ Utility of nodes of a lattice (see epsilon_safe_ola.run): the multiplicative inverse of their
+    information loss, penalized by their suppression or by not being k-anonymous depending on the mode """
+    penalty_prec = information_loss.make_penalty_prec(penalty_factor, max_penalty)
 
-    total_p = 0
-    total_utility = 0
     # Add penalty term to info loss
-    for n in nodes:
-        penalty = n['suppression'] if mode == 'suppression' else int(not n['k_anon_tag'])
-        n['utility'] = penalty_prec(gen_rules, n['gen_state'], penalty)
-        total_utility += n['utility']
-    # Compute utility as the multiplicative inverse of penalized information loss
-    for n in nodes:
-        n['utility'] = 1 / n['utility']
-    # Calculate unnormalized probabilities and compute norm. factor
-    for n in nodes:
-        n['p'] = exp_mechanism(epsilon, n['utility'], sensitivity)
-        total_p += n['p']
-    # Normalize probabilities
-    for n in nodes:
-        n['p'] /= total_p
-        n['p'] = float(n['p'])
-    
-
-    return nodes
+    if mode == 'suppression':
+        penalties = nodes['suppression']
+    else:
+        penalties = (~nodes['k_anon_tag']).astype(int)
+
+    return 1 / penalty_prec.compute_batch(gen_rules, nodes['gen_state'], penalties=penalties)
+
+def compute_utility(nodes, epsilon, penalty_factor, max_penalty, sensitivity, mode, gen_rules):
+    """ Enrich the distribution over the nodes of a lattice (see epsilon_safe_ola.run) with their utility and
+    probability of being sampled by the exponential mechanism. Returns a copy with these two more fields """
+    enriched = np.zeros(len(nodes), dtype=nodes.dtype.descr + [('utility', np.float64), ('p', np.float64)])
+    for name in nodes.dtype.names:
+        enriched[name] = nodes[name]
+    enriched['utility'] = utility(nodes, penalty_factor, mode, gen_rules, max_penalty=max_penalty)
+    # Probabilities of being sampled, see ExponentialMechanism.sample to draw nodes
+    enriched['p'] = ExponentialMechanism(epsilon, enriched['utility'], sensitivity).p
+
+    return enriched
+
+def grid_stats(lattices, epsilons, penalties, sensitivities, mode, gen_rules, max_sup=None, max_info_loss=None):
+    """ output_stats for every epsilon, penalty factor and lattice at once, as a structured array of STATS_DTYPE
+    of shape (epsilons, penalties, lattices). Lattices are stacked distributions over the same nodes (see
+    epsilon_safe_ola.run) and sensitivities broadcast to (penalties, lattices). Same results as compute_utility
+    followed by output_stats, without copying the lattices for every pair of parameters """
+    lattices = np.asarray(lattices)
+    if lattices.ndim == 1:
+        lattices = lattices[np.newaxis]
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    penalties = np.asarray(penalties, dtype=np.float64)
+    sensitivities = np.broadcast_to(np.asarray(sensitivities, dtype=np.float64), (len(penalties), len(lattices)))
+
+    # Only the penalty depends on the penalty factor, the generalization term is computed once
+    gen_states = lattices['gen_state'].reshape(-1, lattices['gen_state'].shape[-1])
+    prec = information_loss.norm_prec.compute_batch(gen_rules, gen_states).reshape(lattices.shape)
+    if mode == 'suppression':
+        node_penalties = lattices['suppression']
+    else:
+        node_penalties = (~lattices['k_anon_tag']).astype(int)
+    utilities = 1 / (prec + penalties[:, np.newaxis, np.newaxis] * node_penalties)
+
+    # Exponential mechanism for every pair of parameters, one epsilon at a time to bound memory
+    stats = np.zeros((len(epsilons), len(penalties), len(lattices)), dtype=STATS_DTYPE)
+    for i, epsilon in enumerate(epsilons):
+        scores = epsilon * utilities / (2 * sensitivities[..., np.newaxis])
+        p = np.exp(scores - logsumexp(scores, axis=-1, keepdims=True))
+        stats[i] = distribution_stats(lattices, p, max_sup=max_sup, max_info_loss=max_info_loss)
+
+    return stats
@@ -1,6 +1,7 @@
 import copy
 import time
 import math
+from collections import OrderedDict
 
 import numpy as np
 from tqdm import tqdm
@@ -9,70 +10,43 @@ import quasi_identifiers
 from quasi_identifiers import QuasiIdentifier
 import experiment
 import data_transform
+import epsilon_safe
 import information_loss
 import lattice
 
 
-def add_k_minimal(node, k_min_set):
-    to_remove = []
-
-    for old_node in k_min_set:
-        if node.has_descendant(old_node):
-            to_remove.append(old_node)
-
-    for doomed in to_remove:
-        k_min_set.remove(doomed)
-
-    k_min_set.add(node)
-    
-
 def compile_k_anonymous_check(logger=None):
     if logger is not None:
         info = logger.print
     else:
         info = print
 
-    def are_k_anonymous_dict(records, qis, k, max_sup):
-        qi_values = lambda record: tuple([record[idx] for idx in qis])
-        eq_classes = {}
-
-        k_anon = True
-        suppression = 0
-
-        max_sup = int(len(records) * max_sup / 100)
-
-        info('Making equivalence classes')
-        for r in records:
-            qi_signature = qi_values(r)
-            if qi_signature in eq_classes.keys():
-                eq_classes[qi_signature] +=1
-            else:
-                eq_classes[qi_signature] = 1
+    def are_k_anonymous(class_sizes, k, max_sup):
+        """ Check k-anonymity and measure suppression, for every sample if the class sizes are a matrix of
+        classes x samples """
+        size = class_sizes.sum(axis=0)
+        max_sup = np.floor(size * max_sup / 100)
 
         info('Checking that all equivalence classes have size k')
-        for val in eq_classes.values():
-            if val < k:
-                if max_sup < val:
-                    k_anon = False
-                else:
-                    max_sup -= val
-                suppression += val
-
-        return k_anon, suppression/len(records)*100
+        suppression = data_transform.suppressed(class_sizes, k)
+        k_anon = suppression <= max_sup
+
+        return k_anon, suppression/size*100
     
-    return are_k_anonymous_dict
+    return are_k_anonymous
 
 
-def k_min(b_node, t_node, k, max_sup, k_min_set=set()):
+def k_min(b_node, t_node, k, max_sup, k_min_set=None):
     """ Core of OLA's operation: build k-minimal set with binary search in generalization
     strategies of lattice """
-    lattice_lvls = lattice.make(b_node, t_node)
-    h = len(lattice_lvls)
+    if k_min_set is None:
+        k_min_set = lattice.Frontier()
+    h = lattice.depth(b_node, t_node)
 
     if h > 2:
         # look halfway between top and bottom node
         h = math.floor(h/2)
-        for n in lattice_lvls[h]:
+        for n in b_node.root.level(b_node, t_node, h):
             if n.suitable_tag == True:
                 k_min(b_node, n, k, max_sup, k_min_set)
             elif n.suitable_tag == False:
@@ -99,60 +73,210 @@ def k_min(b_node, t_node, k, max_sup, k_min_set=set()):
             n = t_node
 
         if n.suitable_tag == True:
-            add_k_minimal(n, k_min_set)
+            k_min_set.add(n)
         elif n.is_suitable(k, max_sup):
             n.set_suitable()
-            add_k_minimal(n, k_min_set)
+            k_min_set.add(n)
 
     return k_min_set
 
-class LatticeDistribution():
-    def __init__(self):
-        self.nodes = {}
-
-    def add_node(self, node):
-        self.nodes[node] = {}
-    
-    def enrich_node(self, node, k_anon_tag, suppression, info_loss):
-        self.nodes[node] = {
-            'gen_state': node.gen_state,
-            'k_anon_tag': k_anon_tag,
-            'suppression': suppression,
-            'info_loss': info_loss,
-        }
-    
-    def list_nodes(self):
-        return self.nodes.keys()
-
-    def get(self):
-        return list(self.nodes.values())
+def distribution_dtype(qis):
+    """ Type of a lattice distribution: one record per node, in the order of the lattice """
+    return np.dtype([
+        ('gen_state', np.int64, (len(qis),)),
+        ('k_anon_tag', bool),
+        ('suppression', np.float64),
+        ('info_loss', np.float64),
+    ])
 
 
 @experiment.step('epsilon-safe-ola')
-def run(records, generalization_rules, k, max_sup, logs=True):
-    prec = information_loss.norm_prec.compute
-
+def run(records, generalization_rules, k, max_sup, masks=None, logs=True):
+    """ Evaluate every node of the lattice, bottom up: the equivalence classes of a node are rolled up from
+    those of its parent with the fewest classes, so that only the previous height is kept in memory. Returns
+    the distribution as a structured array (see distribution_dtype) with the levels of every node in
+    gen_state.
+
+    Many samples of the records can be evaluated at once, given as a boolean matrix of samples x records:
+    the classes are counted for every sample in the same pass, and the distribution has one row per sample """
     l = experiment.Logger(active=logs)
     l.log_step('BUILDING LATTICE')
 
     k_anonymous_check = compile_k_anonymous_check(logger=l)
-    b_node, t_node = lattice.Node.build_network(generalization_rules, records, k_anonymous_check, logger=l)
-
-    l.print(f"visited {b_node.visited_nodes} nodes, checked {b_node.checked_nodes} nodes")
-    l.print(f"num k {b_node.num_suitable} nodes, num not k {b_node.num_not_suitable} nodes")
-
-    distribution = LatticeDistribution()
-    def build_node_list(node):
-        distribution.add_node(node)
-        for c in node.children:
-            build_node_list(c)
-    build_node_list(b_node)
-
-    for n in distribution.list_nodes():
-        info_loss = prec(n.root.rules, n.gen_state)
-        k_anon_tag, suppression = k_anonymous_check(n.apply_gen(), generalization_rules.keys(), k, max_sup)
-        distribution.enrich_node(n, k_anon_tag, suppression, info_loss)
-
-
+    dataset = data_transform.encode(records, generalization_rules)
+    root = lattice.Lattice(generalization_rules, dataset, k_anonymous_check, logger=l)
+
+    weights = None
+    shape = root.size
+    if masks is not None:
+        weights = np.asarray(masks, dtype=np.int64).T
+        shape = (len(masks), root.size)
+
+    distribution = np.zeros(shape, dtype=distribution_dtype(root.qis))
+    distribution['gen_state'] = root.levels_of(np.arange(root.size))
+    distribution['info_loss'] = information_loss.norm_prec.compute_batch(generalization_rules,
+        root.levels_of(np.arange(root.size)))
+
+    l.log_step('EVALUATING LATTICE')
+    scanned = 0
+    previous = {}
+    for h in range(root.top.height + 1):
+        current = {}
+        for i in root.at_height(h).tolist():
+            levels = root.levels(i)
+            frequency_set = None
+            parents = [previous[p] for p in root.parents(i)]
+            if len(parents) > 0:
+                frequency_set = dataset.roll_up(min(parents, key=lambda fs: len(fs.counts)), levels)
+            if frequency_set is None:
+                frequency_set = dataset.scan(levels, weights=weights)
+                scanned += 1
+            current[i] = frequency_set
+
+            k_anon_tag, suppression = k_anonymous_check(frequency_set.counts, k, max_sup)
+            distribution['k_anon_tag'][..., i] = k_anon_tag
+            distribution['suppression'][..., i] = suppression
+        previous = current
+
+    l.print(f"scanned the records for {scanned} of {root.size} nodes")
+
+    return distribution, {}
+
+
+class NodeEvaluator():
+    """ Evaluate nodes of the lattice one at a time, for samplers that never enumerate it. The classes of a node
+    are rolled up from those of the most general cached node it generalizes, e.g.: the current node of a chain
+    moving to one of its children, and from the bottom node when there is none (scanned only if a rule is not a
+    hierarchy). Every node is evaluated once, and the classes of the most recently evaluated ones are kept """
+    def __init__(self, records, generalization_rules, k, max_sup):
+        self.rules = generalization_rules
+        self.k = k
+        self.max_sup = max_sup
+        self.dataset = data_transform.encode(records, generalization_rules)
+        self.root = lattice.Lattice(generalization_rules, self.dataset, None, lazy=True)
+        self.k_anonymous_check = compile_k_anonymous_check(logger=experiment.Logger(active=False))
+        self.bottom = self.dataset.scan(self.root.bottom.levels)
+        self.scanned = 1
+        self.frequency_sets = OrderedDict()
+        self.nodes = {}
 
-    return distribution.get(), {}
\ No newline at end of file
+    def __len__(self):
+        return len(self.nodes)
+
+    def frequency_set(self, levels):
+        """ Equivalence classes of a node, rolled up from the cached node with the fewest classes that it
+        generalizes: its parents are looked up first, e.g.: the current node of a chain moving up """
+        frequency_set = None
+        parents = [levels[:i] + (level - 1,) + levels[i + 1:] for i, level in enumerate(levels) if level > 0]
+        ancestors = [self.frequency_sets[p] for p in parents if p in self.frequency_sets]
+        if len(ancestors) == 0:
+            ancestors = [fs for fs in self.frequency_sets.values() if fs.generalizes_to(levels)]
+        for ancestor in sorted(ancestors, key=lambda fs: len(fs.counts)) + [self.bottom]:
+            frequency_set = self.dataset.roll_up(ancestor, levels)
+            if frequency_set is not None:
+                break
+
+        if frequency_set is None:
+            frequency_set = self.dataset.scan(levels)
+            self.scanned += 1
+
+        self.frequency_sets[levels] = frequency_set
+        if len(self.frequency_sets) > data_transform.FREQUENCY_SET_CACHE:
+            self.frequency_sets.popitem(last=False)
+        return frequency_set
+
+    def __call__(self, index):
+        """ Record of a node in a distribution (see distribution_dtype) """
+        if index not in self.nodes:
+            levels = self.root.levels(index)
+            frequency_set = self.frequency_set(levels)
+
+            node = np.zeros(1, dtype=distribution_dtype(self.root.qis))
+            node['gen_state'] = levels
+            node['k_anon_tag'], node['suppression'] = self.k_anonymous_check(frequency_set.counts, self.k,
+                self.max_sup)
+            node['info_loss'] = information_loss.norm_prec.compute_batch(self.rules, node['gen_state'])
+            self.nodes[index] = node[0]
+
+        return self.nodes[index]
+
+
+@experiment.step('epsilon-safe-mcmc')
+def sample(records, generalization_rules, k, max_sup, epsilon, penalty_factor, sensitivity, mode, steps, chains=4,
+        burn_in=0, seed=None, logs=True):
+    """ Draw nodes from the exponential mechanism over the lattice (see epsilon_safe.compute_utility) without
+    evaluating all of it. Every chain is a Metropolis-Hastings random walk: it proposes a neighbour (child or
+    parent) of its node uniformly and moves there with probability min(1, p(y) * deg(x) / (p(x) * deg(y))),
+    the degrees correcting for nodes with fewer neighbours being proposed more often. Only the nodes proposed
+    are evaluated.
+
+    Returns the draws after burn-in as a structured array of chains x steps (see distribution_dtype, with the
+    utility of every node), and diagnostics of how well the chains mixed: acceptance rate, distinct nodes
+    drawn, nodes evaluated, effective sample size and split R-hat of the utility """
+    l = experiment.Logger(active=logs)
+    l.log_step('SAMPLING LATTICE')
+
+    rng = np.random.default_rng(seed)
+    evaluate = NodeEvaluator(records, generalization_rules, k, max_sup)
+    root = evaluate.root
+
+    utilities = {}
+    def score(index):
+        if index not in utilities:
+            node = evaluate(index)
+            utilities[index] = epsilon_safe.utility(node[np.newaxis], penalty_factor, mode, generalization_rules)[0]
+        return epsilon * utilities[index] / (2 * sensitivity)
+
+    def neighbours(index):
+        return root.children(index) + root.parents(index)
+
+    current = [int(i) for i in rng.integers(root.size, size=chains)]
+    trace = np.zeros((chains, steps), dtype=np.int64)
+    accepted = 0
+    for t in range(burn_in + steps):
+        for c, x in enumerate(current):
+            around = neighbours(x)
+            if len(around) == 0:
+                continue
+            y = around[rng.integers(len(around))]
+            log_ratio = score(y) - score(x) + np.log(len(around)) - np.log(len(neighbours(y)))
+            if log_ratio >= 0 or rng.random() < np.exp(log_ratio):
+                current[c] = y
+                accepted += t >= burn_in
+        if t >= burn_in:
+            trace[:, t - burn_in] = current
+
+    indices, inverse = np.unique(trace, return_inverse=True)
+    dtype = distribution_dtype(root.qis)
+    nodes = np.zeros(len(indices), dtype=dtype.descr + [('utility', np.float64)])
+    for j, i in enumerate(indices.tolist()):
+        for name in dtype.names:
+            nodes[name][j] = evaluate(i)[name]
+        nodes['utility'][j] = utilities[i]
+    draws = nodes[inverse.reshape(trace.shape)]
+
+    results = {
+        'acceptance_rate': accepted / (chains * steps),
+        'distinct_nodes': len(indices),
+        'evaluated_nodes': len(evaluate),
+        'scanned_nodes': evaluate.scanned,
+        'lattice_size': root.size,
+        'effective_sample_size': epsilon_safe.effective_sample_size(draws['utility']),
+        'r_hat': epsilon_safe.r_hat(draws['utility']),
+    }
+    l.print(f"evaluated {results['evaluated_nodes']} of {root.size} nodes, acceptance rate "
+        f"{results['acceptance_rate']:.3f}, ESS {results['effective_sample_size']:.1f}, R-hat {results['r_hat']:.3f}")
+
+    return draws, {
+        'params': {
+            'k': k,
+            'max_sup': max_sup,
+            'epsilon': epsilon,
+            'penalty': penalty_factor,
+            'mode': mode,
+            'chains': chains,
+            'steps': steps,
+            'burn_in': burn_in,
+        },
+        'results': results,
+    }
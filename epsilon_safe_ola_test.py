@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+import data_transform as dt
+import epsilon_safe as es
+import epsilon_safe_ola as ela
+import lattice
+import ola_test
+
+class TestEpsilonSafeOla(unittest.TestCase):
+    def test_run(self):
+        records = ola_test.make_records()
+        gen_rules = ola_test.gen_rules
+        distribution, _ = ela.run(records, gen_rules, k=5, max_sup=10, logs=False)
+        self.assertEqual(len(distribution), 4 * 3 * 3)
+
+        dataset = dt.encode(records, gen_rules)
+        for node in distribution:
+            class_sizes = dataset.class_sizes(dict(zip(gen_rules, node['gen_state'].tolist())))
+            suppressed = dt.suppressed(class_sizes, 5)
+            self.assertEqual(node['k_anon_tag'], suppressed <= int(len(records) * 10 / 100))
+            self.assertAlmostEqual(node['suppression'], suppressed / len(records) * 100)
+
+    def test_run_masks(self):
+        records = ola_test.make_records()
+        gen_rules = ola_test.gen_rules
+        masks = [[i % 3 != j for i in range(len(records))] for j in range(3)]
+        distributions, _ = ela.run(records, gen_rules, k=5, max_sup=10, masks=masks, logs=False)
+        self.assertEqual(distributions.shape, (3, 4 * 3 * 3))
+        for mask, distribution in zip(masks, distributions):
+            draw = [r for r, included in zip(records, mask) if included]
+            expected, _ = ela.run(draw, gen_rules, k=5, max_sup=10, logs=False)
+            self.assertTrue((distribution == expected).all())
+
+    def test_sample(self):
+        records = ola_test.make_records()
+        gen_rules = ola_test.gen_rules
+        for mode, epsilon in [('suppression', 0.02), ('k_anon', 0.002)]:
+            draws, stats = ela.sample(records, gen_rules, 5, 10, epsilon, 0.01, 0.05, mode, 5000, chains=4,
+                burn_in=100, seed=0, logs=False)
+            self.assertEqual(draws.shape, (4, 5000))
+
+            distribution, _ = ela.run(records, gen_rules, k=5, max_sup=10, logs=False)
+            nodes = es.compute_utility(distribution, epsilon, 0.01, len(records), 0.05, mode, gen_rules)
+            root = lattice.Lattice(gen_rules, records, None)
+            indices = [root.index(levels) for levels in draws['gen_state'].reshape(-1, 3).tolist()]
+            for i, node in zip(indices[:100], draws.ravel()[:100]):
+                self.assertEqual(node[['k_anon_tag', 'suppression', 'info_loss', 'utility']].tolist(),
+                    nodes[i][['k_anon_tag', 'suppression', 'info_loss', 'utility']].tolist())
+            frequencies = np.bincount(indices, minlength=root.size) / len(indices)
+            np.testing.assert_allclose(frequencies, nodes['p'], atol=0.01)
+
+            results = stats['results']
+            self.assertLessEqual(results['evaluated_nodes'], root.size)
+            self.assertGreater(results['acceptance_rate'], 0.5)
+            self.assertLess(abs(results['r_hat'] - 1), 0.05)
+            self.assertGreater(results['effective_sample_size'], 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
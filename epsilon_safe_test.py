@@ -0,0 +1,136 @@
+import unittest
+
+import numpy as np
+from scipy.stats import binom
+
+import epsilon_safe as es
+import epsilon_safe_ola as ela
+import ola_test
+
+def big_d_by_sums(k, beta, epsilon, size_d):
+    gamma = (np.exp(epsilon) - 1 + beta) / (np.exp(epsilon))
+    maxim = 0
+    for n in range(int(np.ceil((k/gamma) - 1)), size_d + 1):
+        maxim = max(maxim, sum(binom.pmf(j, n, beta) for j in range(int(np.ceil(gamma*n)), n+1)))
+    return maxim
+
+class TestParameters(unittest.TestCase):
+    def test_big_d(self):
+        for k, beta, size_d in [(5, 0.25, 120), (25, 0.1, 160), (2, 0.5, 60)]:
+            epsilon = -np.log(1 - beta)
+            expected = big_d_by_sums(k, beta, epsilon, size_d)
+            self.assertAlmostEqual(es.big_d(k, beta, epsilon, size_d), expected, places=12)
+
+    def test_big_d_tolerance(self):
+        k, beta, size_d = 5, 0.25, 100000
+        epsilon = -np.log(1 - beta)
+        exact = es.big_d(k, beta, epsilon, size_d)
+        estimate = es.big_d(k, beta, epsilon, size_d, tolerance=1e-3)
+        self.assertLessEqual(estimate, exact)
+        self.assertLessEqual(exact - estimate, 1e-3)
+
+    def test_parameters(self):
+        self.assertEqual(es.parameters(25, 0.5, 0.1, 1000), (None, None))
+        epsilon_prime, delta = es.parameters(25, 0.25, 1, 1000)
+        self.assertAlmostEqual(epsilon_prime, 1 + np.log(0.75))
+        self.assertAlmostEqual(delta, es.big_d(25, 0.25, -np.log(0.75), 1000))
+
+    def test_delta_does_not_depend_on_epsilon(self):
+        curve = es.DeltaCurve(25, 1000)
+        for epsilon in [0.5, 1, 2]:
+            _, delta = es.parameters(25, 0.25, epsilon, 1000)
+            self.assertAlmostEqual(delta, curve(0.25))
+
+    def test_frontier(self):
+        betas = np.linspace(0.05, 0.95, 19)
+        epsilons = [0.1, 0.5, 1, 3]
+        by_beta, by_epsilon = es.frontier(25, 1000, 0.01, betas, epsilons)
+        for row in by_beta:
+            _, delta = es.parameters(25, row['beta'], row['min_epsilon'] + 1e-9, 1000)
+            self.assertAlmostEqual(row['delta'], delta)
+            self.assertEqual(row['feasible'], delta <= 0.01)
+        for row in by_epsilon:
+            if np.isnan(row['max_beta']):
+                self.assertFalse((by_beta['feasible'] & (betas < es.max_beta(row['epsilon']))).any())
+                continue
+            epsilon_prime, delta = es.parameters(25, row['max_beta'], row['epsilon'], 1000)
+            self.assertGreater(epsilon_prime, 0)
+            self.assertLessEqual(delta, 0.01)
+            self.assertGreaterEqual(row['max_beta'], betas[by_beta['feasible'] & (betas < es.max_beta(row['epsilon']))].max())
+
+
+class TestExponentialMechanism(unittest.TestCase):
+    def test_probabilities(self):
+        mechanism = es.ExponentialMechanism(2, [1, 2, 3], 1)
+        weights = np.exp(np.array([1, 2, 3]))
+        np.testing.assert_allclose(mechanism.p, weights / weights.sum())
+
+    def test_large_utilities(self):
+        mechanism = es.ExponentialMechanism(1, [5000, 5001, 10], 0.5)
+        self.assertAlmostEqual(mechanism.p.sum(), 1)
+        self.assertAlmostEqual(mechanism.p[1] / mechanism.p[0], np.exp(1))
+        self.assertEqual(mechanism.p[2], 0)
+
+    def test_sample(self):
+        mechanism = es.ExponentialMechanism(2, [1, 2, 3], 1)
+        draws = mechanism.sample(100000, rng=np.random.default_rng(0))
+        np.testing.assert_allclose(np.bincount(draws, minlength=3) / len(draws), mechanism.p, atol=0.01)
+        self.assertIn(mechanism.sample(rng=np.random.default_rng(0)), [0, 1, 2])
+
+
+class TestStats(unittest.TestCase):
+    def test_output_stats(self):
+        nodes = np.zeros(3, dtype=[('suppression', np.float64), ('info_loss', np.float64), ('p', np.float64)])
+        nodes['suppression'] = [2, 10, 4]
+        nodes['info_loss'] = [0.4, 0.1, 0.8]
+        nodes['p'] = [0.5, 0.3, 0.2]
+        stats = es.output_stats(nodes, max_sup=5, max_info_loss=0.5)
+        # only the first node is good, its suppression is counted twice
+        expected = (0.39, 2, 10, 0.5 * 2 * 2 + 0.3 * 10 + 0.2 * 4, 16 / 3, 0.5, 1 / 3)
+        np.testing.assert_allclose(stats, expected)
+
+    def test_grid_stats(self):
+        records = ola_test.make_records()
+        gen_rules = ola_test.gen_rules
+        masks = [[i % 3 != j for i in range(len(records))] for j in range(3)]
+        lattices, _ = ela.run(records, gen_rules, k=5, max_sup=10, masks=masks, logs=False)
+        sizes = np.sum(masks, axis=1)
+        epsilons, penalties = [0.1, 1, 2], [0.01, 0.5]
+
+        for mode in ('suppression', 'k_anon'):
+            sensitivities = np.outer(penalties, 100 / sizes) if mode == 'suppression' else np.array(penalties)[:, None]
+            stats = es.grid_stats(lattices, epsilons, penalties, sensitivities, mode, gen_rules, max_sup=5,
+                max_info_loss=0.5)
+            self.assertEqual(stats.shape, (3, 2, 3))
+            for i, epsilon in enumerate(epsilons):
+                for j, penalty in enumerate(penalties):
+                    for l, lattice in enumerate(lattices):
+                        sensitivity = penalty * (100 / sizes[l]) if mode == 'suppression' else penalty
+                        nodes = es.compute_utility(lattice, epsilon, penalty, sizes[l], sensitivity, mode, gen_rules)
+                        expected = es.output_stats(nodes, max_sup=5, max_info_loss=0.5)
+                        np.testing.assert_allclose(stats[i, j, l].tolist(), expected)
+            self.assertNotIn('p', lattices.dtype.names)
+
+
+class TestDiagnostics(unittest.TestCase):
+    def test_independent_draws(self):
+        traces = np.random.default_rng(0).normal(size=(4, 2000))
+        self.assertAlmostEqual(es.r_hat(traces), 1, places=2)
+        self.assertGreater(es.effective_sample_size(traces), 6000)
+
+    def test_correlated_draws(self):
+        rng = np.random.default_rng(0)
+        traces = np.zeros((4, 2000))
+        for t in range(1, 2000):
+            traces[:, t] = 0.9 * traces[:, t - 1] + rng.normal(size=4)
+        # the integrated autocorrelation time of an AR(1) chain is (1 + a) / (1 - a)
+        self.assertAlmostEqual(es.effective_sample_size(traces) / (8000 / 19), 1, delta=0.25)
+
+    def test_not_mixed(self):
+        traces = np.random.default_rng(0).normal(size=(4, 2000)) + np.arange(4)[:, None]
+        self.assertGreater(es.r_hat(traces), 1.5)
+        self.assertEqual(es.r_hat(np.ones((4, 100)) * np.arange(4)[:, None]), np.inf)
+
+
+if __name__ == '__main__':
+    unittest.main()
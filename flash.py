@@ -0,0 +1,87 @@
+import heapq
+
+import numpy as np
+
+import lattice
+
+
+def heuristic(node):
+    """ Order in which Flash looks at nodes: lower first, then the least generalized relative to the
+    generalization rules, then the lowest index """
+    return node.height, sum(l / m for l, m in zip(node.levels, node.root.max_levels)), node.index
+
+
+def successors(node, t_node):
+    """ Children of a node in the sub-lattice below t_node, sorted by heuristic """
+    return sorted((c for c in node.children if c.is_in_path(node, t_node)), key=heuristic)
+
+
+def find_path(head, t_node):
+    """ Greedy vertical path from a node, always moving to the first untagged successor """
+    path = [head]
+    while True:
+        untagged = [n for n in successors(path[-1], t_node) if n.suitable_tag is None]
+        if len(untagged) == 0:
+            return path
+        path.append(untagged[0])
+
+
+def check_path(path, k, max_sup, heap):
+    """ Binary search for the lowest suitable node of a path. Nodes found not suitable go to the heap,
+    from which the search continues upwards """
+    low, high = 0, len(path) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        n = path[mid]
+        if n.suitable_tag == True or (n.suitable_tag is None and n.is_suitable(k, max_sup)):
+            if n.suitable_tag is None:
+                n.set_suitable()
+            high = mid - 1
+        else:
+            if n.suitable_tag is None:
+                n.set_non_suitable()
+            heapq.heappush(heap, (heuristic(n), n.index))
+            low = mid + 1
+
+
+def minimal(b_node, t_node):
+    """ Suitable nodes of a fully tagged sub-lattice whose parents in it are all not suitable """
+    root = b_node.root
+    if root.lazy:
+        # only the tagged nodes are stored, there is no need to enumerate the whole sub-lattice
+        indices = np.array(sorted(i for i, tag in root.tags.items() if tag == lattice.SUITABLE), dtype=np.int64)
+        levels = root.levels_of(indices)
+        indices = indices[((levels >= b_node.levels) & (levels <= t_node.levels)).all(axis=1)]
+    else:
+        indices = root.box(b_node.levels, t_node.levels)
+        indices = indices[root.tags[indices] == lattice.SUITABLE]
+
+    k_min_set = lattice.Frontier()
+    for i in indices.tolist():
+        parents = [i - stride for level, b_level, stride in zip(root.levels(i), b_node.levels, root.strides)
+                   if level > b_level]
+        if all(root.tag(p) == lattice.NOT_SUITABLE for p in parents):
+            k_min_set.add(root.node(i))
+
+    return k_min_set
+
+
+def k_min(b_node, t_node, k, max_sup):
+    """ Flash: tag every node of the sub-lattice between two nodes by checking greedy vertical paths, level by
+    level from the bottom, then collect the k-minimal nodes. The set holds exactly the k-minimal nodes, while
+    that of ola.k_min may also hold some of their generalizations: only the optimal node of a monotone loss is
+    guaranteed to be the same, not the nodes checked or the stats of the search """
+    root = b_node.root
+    heap = []
+    for h in range(lattice.depth(b_node, t_node)):
+        for n in sorted(root.level(b_node, t_node, h), key=heuristic):
+            if n.suitable_tag is not None:
+                continue
+            check_path(find_path(n, t_node), k, max_sup, heap)
+            while len(heap) > 0:
+                _, index = heapq.heappop(heap)
+                for up in successors(root.node(index), t_node):
+                    if up.suitable_tag is None:
+                        check_path(find_path(up, t_node), k, max_sup, heap)
+
+    return minimal(b_node, t_node)
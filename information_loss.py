@@ -1,10 +1,52 @@
+from collections import Counter
+
 import numpy as np
 
 class InformationLoss():
-    def __init__(self, name, formula, need_generalization=True):
+    """ A formula either needs the original and generalized records, the encoded dataset (see
+    data_transform.EncodedDataset) or only the generalization state. A loss that is a sum of one term per
+    quasi-identifier also has a function giving the terms of every level, to score many nodes at once. A
+    monotone loss never decreases when a node is generalized further """
+    def __init__(self, name, formula, need_generalization=True, need_dataset=False, terms=None, monotone=False):
         self.name = name
         self.compute = formula
         self.need_generalization = need_generalization
+        self.need_dataset = need_dataset
+        self.terms = terms
+        self.monotone = monotone
+
+    def table(self, gen_rules, dataset=None, weights=None):
+        """ Contribution to the loss of every quasi-identifier (in the order of the rules) at each of its levels """
+        if self.terms is None:
+            raise ValueError(f'{self.name} is not a sum of one term per quasi-identifier')
+        return self.terms(gen_rules, dataset=dataset, weights=weights)
+
+    def compute_batch(self, gen_rules, levels, dataset=None, weights=None):
+        """ Loss of many nodes at once, given as a matrix with the levels of a node in each row """
+        levels = np.asarray(levels, dtype=np.int64).reshape(-1, len(gen_rules))
+        if self.terms is not None:
+            loss = np.zeros(len(levels))
+            for i, table in enumerate(self.table(gen_rules, dataset=dataset, weights=weights)):
+                loss += table[levels[:, i]]
+            return loss
+
+        # every distinct node is computed once, and the original records are projected once
+        distinct, inverse = np.unique(levels, axis=0, return_inverse=True)
+        projection = dataset.project() if self.need_generalization and not self.need_dataset else None
+        losses = []
+        for row in distinct:
+            gen_state = {qi: int(level) for qi, level in zip(gen_rules.keys(), row)}
+            if self.need_dataset:
+                losses.append(self.compute(gen_rules, gen_state, dataset))
+            elif self.need_generalization:
+                losses.append(self.compute(gen_rules, gen_state, projection, dataset.project(gen_state)))
+            else:
+                losses.append(self.compute(gen_rules, gen_state))
+        return np.array(losses, dtype=np.float64)[inverse.reshape(-1)]
+
+
+def prec_terms(gen_rules, dataset=None, weights=None):
+    return [np.arange(rule.max_level + 1) / rule.max_level for rule in gen_rules.values()]
 
 
 def prec_formula(gen_rules, gen_status, other=None, stuff=None):
@@ -14,7 +56,7 @@ def prec_formula(gen_rules, gen_status, other=None, stuff=None):
 
     return loss
 
-prec = InformationLoss('Prec', prec_formula, need_generalization=False)
+prec = InformationLoss('Prec', prec_formula, need_generalization=False, terms=prec_terms, monotone=True)
 
 
 def norm_prec_formula(gen_rules, gen_status, other=None, stuff=None):
@@ -24,7 +66,11 @@ def norm_prec_formula(gen_rules, gen_status, other=None, stuff=None):
 
     return loss / len(gen_rules)
 
-norm_prec = InformationLoss('NormPrec', norm_prec_formula, need_generalization=False)
+def norm_prec_terms(gen_rules, dataset=None, weights=None):
+    return [table / len(gen_rules) for table in prec_terms(gen_rules)]
+
+norm_prec = InformationLoss('NormPrec', norm_prec_formula, need_generalization=False, terms=norm_prec_terms,
+    monotone=True)
 
 
 def weighted_norm_prec_formula(gen_rules, gen_status, other=None, stuff=None, weights=None):
@@ -37,7 +83,14 @@ def weighted_norm_prec_formula(gen_rules, gen_status, other=None, stuff=None, we
 
     return loss / sum(weights)
 
-weighted_norm_prec = InformationLoss('WeightedNormPrec', weighted_norm_prec_formula, need_generalization=False)
+def weighted_norm_prec_terms(gen_rules, dataset=None, weights=None):
+    if weights == None:
+        weights = [1] * len(gen_rules)
+
+    return [table * weight / sum(weights) for table, weight in zip(prec_terms(gen_rules), weights)]
+
+weighted_norm_prec = InformationLoss('WeightedNormPrec', weighted_norm_prec_formula, need_generalization=False,
+    terms=weighted_norm_prec_terms, monotone=True)
 
 
 def make_penalty_prec(penalty_factor, max_penalty):
@@ -47,61 +100,74 @@ def make_penalty_prec(penalty_factor, max_penalty):
 
         return result
 
-    return InformationLoss('PenaltyPrec', penalty_prec_formula, need_generalization=False)
+    return PenaltyLoss('PenaltyPrec', penalty_prec_formula, penalty_factor, need_generalization=False,
+        terms=norm_prec_terms)
+
 
+class PenaltyLoss(InformationLoss):
+    """ Loss of a formula taking a penalty for every node on top of its generalization state """
+    def __init__(self, name, formula, penalty_factor, **kwargs):
+        super().__init__(name, formula, **kwargs)
+        self.penalty_factor = penalty_factor
+
+    def compute_batch(self, gen_rules, levels, dataset=None, weights=None, penalties=None):
+        """ Loss of many nodes at once (see InformationLoss.compute_batch), with the penalty of every node """
+        loss = super().compute_batch(gen_rules, levels, dataset=dataset, weights=weights)
+        if penalties is None:
+            return loss
+        return loss + self.penalty_factor * np.asarray(penalties)
+
+
+def dm_star_from_counts(class_sizes):
+    """ Sum of the squared sizes of the equivalence classes """
+    class_sizes = np.asarray(class_sizes, dtype=np.int64)
+    return int((class_sizes ** 2).sum())
 
 def dm_star_formula(gen_rules, gen_status, dataset, generalization):
-    def group_generalization(records, qis):
-        values = lambda record: tuple([record[idx] for idx in qis])
-
-        eq_classes = {}
-        for r in records:
-            r_signature = values(r)
-            if r_signature in eq_classes.keys():
-                eq_classes[r_signature].append(r)
-            else:
-                eq_classes[r_signature] = [r]
+    classes = Counter(tuple(r[q] for q in gen_rules.keys()) for r in generalization)
+    return dm_star_from_counts(list(classes.values()))
 
-        return eq_classes.values()
+def encoded_dm_star_formula(gen_rules, gen_status, dataset):
+    return dm_star_from_counts(dataset.class_sizes(gen_status))
 
-    grouped_generalization = group_generalization(generalization, gen_rules.keys())
-    records_per_class = [len(ec) for ec in grouped_generalization]
-    loss = 0
-    for ec_size in records_per_class:
-        loss += ec_size**2
+dm_star = InformationLoss('DM*', encoded_dm_star_formula, need_generalization=False, need_dataset=True,
+    monotone=True)
 
-    return loss
 
-dm_star = InformationLoss('DM*', dm_star_formula)
+def entropy_from_counts(original_counts, generalized_counts):
+    """ Non-uniform entropy from the number of records with each original and each generalized value of every
+    quasi-identifier: every record loses log2 of the frequency of its original value in its generalized value,
+    i.e.: sum(n_b * log2(n_b)) - sum(n_a * log2(n_a)) per quasi-identifier """
+    def n_log_n(counts):
+        counts = np.asarray(counts, dtype=np.float64)
+        counts = counts[counts > 0]
+        return (counts * np.log2(counts)).sum()
+
+    loss = 0
+    for a, b in zip(original_counts, generalized_counts):
+        loss += n_log_n(b) - n_log_n(a)
 
+    return float(loss)
 
 def entropy_formula(gen_rules, gen_status, dataset, generalization):
-    def update_freq(store, value):
-        if value in store.keys():
-            store[value] += 1
-        else:
-            store[value] = 1
-
     qis = gen_rules.keys()
-    # Build frequency dictionaries
-    freq_a = {}
-    freq_b = {}
-    for q in qis:
-        freq_a[q] = {}
-        freq_b[q] = {}
-        for d in dataset:
-            update_freq(freq_a[q], d[q])
-        for r in generalization:
-            update_freq(freq_b[q], r[q])
-
-    summation = 0
-    for q in qis:
-        for i, d in enumerate(dataset):
-            a = d[q]
-            b = generalization[i][q]
-            summation += np.log2(freq_a[q][a]/freq_b[q][b])
-
-
-    return -summation
-
-entropy = InformationLoss('Entropy', entropy_formula)
\ No newline at end of file
+    return entropy_from_counts(
+        [list(Counter(d[q] for d in dataset).values()) for q in qis],
+        [list(Counter(r[q] for r in generalization).values()) for q in qis],
+    )
+
+def encoded_entropy_formula(gen_rules, gen_status, dataset):
+    return entropy_from_counts(
+        [dataset.value_counts(q) for q in gen_rules.keys()],
+        [dataset.value_counts(q, gen_status[q]) for q in gen_rules.keys()],
+    )
+
+def entropy_terms(gen_rules, dataset=None, weights=None):
+    return [
+        np.array([entropy_from_counts([dataset.value_counts(q)], [dataset.value_counts(q, level)])
+            for level in range(rule.max_level + 1)])
+        for q, rule in gen_rules.items()
+    ]
+
+entropy = InformationLoss('Entropy', encoded_entropy_formula, need_generalization=False, need_dataset=True,
+    terms=entropy_terms, monotone=True)
@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import data_transform as dt
+import information_loss as il
+import quasi_identifiers as qi
+
+records = [
+    ['39', 'State-gov', 'Bachelors', 'Never-married', '<=50K'],
+    ['50', 'Self-emp-not-inc', 'Bachelors', 'Married-civ-spouse', '<=50K'],
+    ['38', 'Private', 'HS-grad', 'Divorced', '<=50K'],
+    ['53', 'Private', '11th', 'Married-civ-spouse', '>50K'],
+    ['28', 'Private', 'Bachelors', 'Married-civ-spouse', '<=50K'],
+    ['37', 'Private', 'Masters', 'Married-civ-spouse', '>50K'],
+]
+
+gen_rules = {
+    0: qi.generalize_age_rule,
+    1: qi.adult_generalize_workclass_rule,
+    3: qi.adult_generalize_marital_status_rule,
+}
+
+class TestInformationLoss(unittest.TestCase):
+    def test_dm_star(self):
+        dataset = dt.encode(records, gen_rules)
+        gen_state = {0: 3, 1: 1, 3: 2}
+        self.assertEqual(il.dm_star.compute(gen_rules, gen_state, dataset), 1 + 1 + 16)
+        self.assertEqual(il.dm_star_formula(gen_rules, gen_state, records, dt.apply_gen(records, gen_state, gen_rules)), 18)
+
+    def test_entropy(self):
+        dataset = dt.encode(records, gen_rules)
+        gen_state = {0: 1, 1: 2, 3: 0}
+        generalization = dt.apply_gen(records, gen_state, gen_rules)
+        # every record loses log2 of the share of its original value among the records with its generalized value
+        expected = 0
+        for q in gen_rules:
+            for d, r in zip(records, generalization):
+                original = sum(1 for other in records if other[q] == d[q])
+                generalized = sum(1 for other in generalization if other[q] == r[q])
+                expected -= np.log2(original / generalized)
+        self.assertAlmostEqual(il.entropy.compute(gen_rules, gen_state, dataset), expected)
+        self.assertAlmostEqual(il.entropy_formula(gen_rules, gen_state, records, generalization), expected)
+
+    def test_compute_batch(self):
+        from itertools import product
+        dataset = dt.encode(records, gen_rules)
+        levels = list(product(range(4), range(3), range(3)))
+        states = [dict(zip(gen_rules, row)) for row in levels]
+        for loss in [il.prec, il.norm_prec, il.weighted_norm_prec]:
+            expected = [loss.compute(gen_rules, state) for state in states]
+            np.testing.assert_allclose(loss.compute_batch(gen_rules, levels), expected)
+        for loss in [il.entropy, il.dm_star]:
+            expected = [loss.compute(gen_rules, state, dataset) for state in states]
+            np.testing.assert_allclose(loss.compute_batch(gen_rules, levels, dataset=dataset), expected)
+
+        penalty_prec = il.make_penalty_prec(0.5, 1)
+        penalties = [i % 3 for i in range(len(levels))]
+        expected = [penalty_prec.compute(gen_rules, state, p) for state, p in zip(states, penalties)]
+        np.testing.assert_allclose(penalty_prec.compute_batch(gen_rules, levels, penalties=penalties), expected)
+        # positional arguments mean the same as for any other loss
+        np.testing.assert_allclose(penalty_prec.compute_batch(gen_rules, levels, None, None),
+            il.norm_prec.compute_batch(gen_rules, levels))
+
+    def test_compute_batch_without_terms(self):
+        dataset = dt.encode(records, gen_rules)
+        levels = [(3, 1, 2), (0, 0, 0), (3, 1, 2)]
+        states = [dict(zip(gen_rules, row)) for row in levels]
+        loss = il.InformationLoss('DM*', il.dm_star_formula)
+        expected = [il.dm_star_formula(gen_rules, state, records, dt.apply_gen(records, state, gen_rules))
+            for state in states]
+        with mock.patch.object(dataset, 'project', wraps=dataset.project) as project:
+            np.testing.assert_allclose(loss.compute_batch(gen_rules, levels, dataset=dataset), expected)
+        # the original records once, then every distinct node once
+        self.assertEqual(project.call_count, 3)
+        with self.assertRaises(ValueError):
+            loss.table(gen_rules, dataset=dataset)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import copy
 import time
 import math
 
+import numpy as np
 from tqdm import tqdm
 
 import quasi_identifiers
@@ -10,33 +11,38 @@ import experiment
 import data_transform
 import lattice
 
-def add_info_loss_minimal(node, info_loss_min_set):
-    to_remove = []
-
-    for old_node in info_loss_min_set:
-        if old_node.has_descendant(node):
-            to_remove.append(old_node)
-
-    for doomed in to_remove:
-        info_loss_min_set.remove(doomed)
-
-    info_loss_min_set.add(node)
-    
-
 def compile_info_loss_check(metric, weights=None, logger=None):
+    if weights is not None and metric.need_dataset:
+        # the formulas computed on the encoded dataset do not weigh the quasi-identifiers
+        raise ValueError(f'{metric.name} does not take weights')
+
     if logger is not None:
         info = logger.print
     else:
         info = print
 
-    def info_loss(release, node, max_loss):
-        loss = metric.compute(
-            node.root.rules,
-            node.gen_state,
-            node.root.records,
-            release,
-            weights=weights,
-        )
+    def info_loss(node, max_loss):
+        if metric.need_dataset:
+            loss = metric.compute(
+                node.root.rules,
+                node.gen_state,
+                node.root.dataset,
+            )
+        elif metric.need_generalization:
+            info('Simulating release')
+            loss = metric.compute(
+                node.root.rules,
+                node.gen_state,
+                node.root.projection,
+                node.project(),
+                weights=weights,
+            )
+        else:
+            loss = metric.compute(
+                node.root.rules,
+                node.gen_state,
+                weights=weights,
+            )
 
         info(f'loss {loss}')
 
@@ -48,14 +54,15 @@ def compile_info_loss_check(metric, weights=None, logger=None):
     return {'compute': info_loss, 'need_generalization': metric.need_generalization}
 
 node_count = 0
-def info_loss_min(b_node, t_node, info_loss, info_loss_min_set=set()):
-    lattice_lvls = lattice.make(b_node, t_node)
-    h = len(lattice_lvls)
+def info_loss_min(b_node, t_node, info_loss, info_loss_min_set=None):
+    if info_loss_min_set is None:
+        info_loss_min_set = lattice.Frontier(upwards=False)
+    h = lattice.depth(b_node, t_node)
 
     if h > 2:
         # look halfway between top and bottom node
         h = math.floor(h/2)
-        for n in lattice_lvls[h]:
+        for n in b_node.root.level(b_node, t_node, h):
             if n.suitable_tag == True:
                 info_loss_min(n, t_node, info_loss, info_loss_min_set)
             elif n.suitable_tag == False:
@@ -80,56 +87,43 @@ def info_loss_min(b_node, t_node, info_loss, info_loss_min_set=set()):
             n = b_node
 
         if n.suitable_tag == True:
-            add_info_loss_minimal(n, info_loss_min_set)
+            info_loss_min_set.add(n)
         elif n.is_suitable(info_loss):
             n.set_suitable()
-            add_info_loss_minimal(n, info_loss_min_set)
+            info_loss_min_set.add(n)
 
     return info_loss_min_set
 
 
-def make_release(records, qis, k):
-    original_size = len(records)
-    qi_values = lambda record: tuple([record[idx] for idx in qis])
+def make_release(node, k):
+    dataset = node.root.dataset
+    released, class_sizes = dataset.release(node.gen_state, k)
+    release = dataset.decode(node.gen_state, rows=released)
 
-    eq_classes = {}
-    release = []
-
-    for r in records:
-        qi_signature = qi_values(r)
-        if qi_signature in eq_classes.keys():
-            eq_classes[qi_signature].append(r)
-        else:
-            eq_classes[qi_signature] = [r]
-
-    sup_ec = 0
-    sup_rec = 0
-    for val in eq_classes.values():
-        if len(val) >= k:
-            release += val
-        else:
-            sup_ec += 1
-            sup_rec += len(val)
+    sup_ec = int((class_sizes < k).sum())
+    sup_rec = len(dataset) - len(released)
 
     stats = {
-        'eq_classes_before_sup': len(eq_classes.keys()),
+        'eq_classes_before_sup': len(class_sizes),
         'suppressed_classes': sup_ec,
         'suppressed_records': sup_rec,
-        'perc_suppressed_records': round((sup_rec/original_size)*100, 2),
+        'perc_suppressed_records': round((sup_rec/len(dataset))*100, 2),
     }
 
     return release, stats
     
 
 @experiment.step('inverted-ola')
-def run(records, generalization_rules, max_loss, max_sup, info_loss, weights=None, logs=True):
+def run(records, generalization_rules, max_loss, max_sup, info_loss, weights=None, lazy=False, logs=True):
     l = experiment.Logger(active=logs)
     l.log_step('BUILDING LATTICE')
 
     info_loss_check = compile_info_loss_check(info_loss, weights=weights, logger=l)
+    records = data_transform.encode(records, generalization_rules)
     b_node, t_node = lattice.Node.build_network(generalization_rules, records, info_loss_check,
         suitable_upwards=False,  # Unlike OLA, predictively tag towards the bottom
-        logger=l)
+        logger=l,
+        lazy=lazy)
 
     l.log_step('SEARCHING LATTICE')
     info_loss_max = info_loss_min(b_node, t_node, max_loss)
@@ -139,8 +133,8 @@ def run(records, generalization_rules, max_loss, max_sup, info_loss, weights=Non
         l.log_step('NO STRATEGY FOUND')
         return None
 
-    l.print(f"visited {b_node.visited_nodes} nodes, checked {b_node.checked_nodes} nodes")
-    l.print(f"{b_node.num_suitable} good nodes, {b_node.num_not_suitable} bad nodes")
+    l.print(f"visited {b_node.root.visited_nodes} nodes, checked {b_node.root.checked_nodes} nodes")
+    l.print(f"{b_node.root.num_suitable} good nodes, {b_node.root.num_not_suitable} bad nodes")
 
     l.log_step('CHOOSING STRATEGY')
 
@@ -148,40 +142,21 @@ def run(records, generalization_rules, max_loss, max_sup, info_loss, weights=Non
     def get_k(node, records, max_sup):
         max_sup = int(len(records) * max_sup / 100)
 
-        qis = node.root.rules.keys()
-        records = node.apply_gen()
-
-        qi_values = lambda record: tuple([record[idx] for idx in qis])
-        eq_classes = {}
-
-        for r in records:
-            qi_signature = qi_values(r)
-            if qi_signature in eq_classes.keys():
-                eq_classes[qi_signature] +=1
-            else:
-                eq_classes[qi_signature] = 1
-
-        sizes = sorted(eq_classes.values())
-        
-        min_k = len(records)
-
-        for s in sizes:
-            if s > max_sup:
-                min_k = s
-                break
-            else:
-                max_sup -= s
+        sizes = np.sort(node.class_sizes())
 
+        # The smallest class that cannot be suppressed along with all the smaller ones
+        first_kept = np.searchsorted(np.cumsum(sizes), max_sup, side='right')
+        if first_kept < len(sizes):
+            return int(sizes[first_kept])
 
-        return min_k
+        return len(records)
 
 
     losses = [(get_k(node, records, max_sup), node) for node in info_loss_max]
     optimal_k, optimal_node = max(losses, key=lambda x: x[0])
 
     l.log_step('GENERATING RELEASE with k {}: {}'.format(optimal_k, optimal_node))
-    release = optimal_node.apply_gen()
-    release, release_stats = make_release(optimal_node.apply_gen(), generalization_rules.keys(), optimal_k)
+    release, release_stats = make_release(optimal_node, optimal_k)
 
     stats = {
         'params': {
@@ -193,10 +168,10 @@ def run(records, generalization_rules, max_loss, max_sup, info_loss, weights=Non
         'results': experiment.merge_stats(release_stats, {
             'k': optimal_k,
             'node': str(optimal_node),
-            'visited_nodes': b_node.visited_nodes,
-            'checked_nodes': b_node.checked_nodes,
-            'b_node.good_info_loss_nodes': b_node.num_suitable,
-            'b_node.bad_info_loss_nodes': b_node.num_not_suitable,
+            'visited_nodes': b_node.root.visited_nodes,
+            'checked_nodes': b_node.root.checked_nodes,
+            'b_node.good_info_loss_nodes': b_node.root.num_suitable,
+            'b_node.bad_info_loss_nodes': b_node.root.num_not_suitable,
         })
     }
 
@@ -0,0 +1,20 @@
+import unittest
+
+import information_loss
+import inverse_ola
+import ola_test
+
+class TestInverseOla(unittest.TestCase):
+    def test_weights(self):
+        records = ola_test.make_records()
+        gen_rules = ola_test.gen_rules
+        _, stats = inverse_ola.run(records, gen_rules, 0.5, 5, information_loss.weighted_norm_prec,
+            weights=[1, 2, 1], logs=False)
+        self.assertGreater(stats['results']['k'], 1)
+        for metric in [information_loss.dm_star, information_loss.entropy]:
+            with self.assertRaises(ValueError):
+                inverse_ola.run(records, gen_rules, 0.5, 5, metric, weights=[1, 2, 1], logs=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,76 +1,303 @@
-import copy
+import math
+from itertools import product
 
-class Node():
-    def __init__(self, gen_state, root=None):
-        self.gen_state = gen_state
-        if root == None:
-            self.root = self
-            self.print = print
-        else:
-            self.root = root
+import numpy as np
 
-        self.children = []
-        self.parents = []
-        self._suitable_tag = None
-    
-    @classmethod
-    def build_network(cls, rules, records, suitable_check, suitable_upwards=True, logger=None):
+import data_transform
+
+# Tags of the nodes in a lattice, stored in a compact array
+UNTAGGED = -1
+NOT_SUITABLE = 0
+SUITABLE = 1
+
+# Boxes with at most this many nodes are enumerated without numpy
+SMALL_BOX = 256
+
+
+class Lattice():
+    """ Generalization lattice in which every node is a mixed-radix integer over the generalization
+    levels of the quasi-identifiers. Children, parents and heights are computed arithmetically, so
+    no node needs to be built before the search reaches it.
+
+    A lazy lattice also keeps its tags in a dictionary and caches the nodes (and their neighbour
+    lists) it hands out, so that its memory grows with the nodes visited rather than with its size """
+    def __init__(self, rules, records, suitable_check, suitable_upwards=True, logger=None, lazy=False):
+        self.rules = rules
+        self.qis = list(rules.keys())
+        self.max_levels = [rules[qi].max_level for qi in self.qis]
+        self.radices = [max_level + 1 for max_level in self.max_levels]
+        # the first quasi-identifier is the least significant digit
+        self.strides = [1]
+        for radix in self.radices[:-1]:
+            self.strides.append(self.strides[-1] * radix)
         # the number of nodes is, given quasi identifier: k and max generalization level: max_k, the product of all max_k
-        init_state = {qi: 0 for (qi, _) in rules.items()}
-        b_node = cls(init_state)
-        b_node.visited_nodes = 0
-        b_node.checked_nodes = 0
-        b_node.num_suitable = 0
-        b_node.num_not_suitable = 0
-        b_node.all_states = {}
-        b_node.rules = rules
-        b_node.suitable_check = suitable_check
-        b_node.suitable_upwards = suitable_upwards
-        b_node.records = records
+        self.size = self.strides[-1] * self.radices[-1]
+
+        self.dataset = data_transform.encode(records, rules)
+        self._projection = None
+        self.suitable_check = suitable_check
+        self.suitable_upwards = suitable_upwards
+        self.print = print
         if logger != None:
-            b_node.set_logger(logger)
-        b_node.make_children()
+            self.set_logger(logger)
+
+        self.visited_nodes = 0
+        self.checked_nodes = 0
+        self.num_suitable = 0
+        self.num_not_suitable = 0
+
+        self.lazy = lazy
+        if lazy:
+            self.tags = {}
+            self.nodes = {}
+        else:
+            self.tags = np.full(self.size, UNTAGGED, dtype=np.int8)
+        self._heights = None
+        self._height_index = None
+
+        self.bottom = self.node(0)
+        self.top = self.node(self.size - 1)
+
+    def set_logger(self, logger):
+        self.print = logger.print
+
+    @property
+    def projection(self):
+        """ The original records reduced to their quasi-identifiers, decoded the first time they are needed """
+        if self._projection is None:
+            self._projection = self.dataset.project()
+
+        return self._projection
+
+    def node(self, index, levels=None):
+        if self.lazy and index in self.nodes:
+            return self.nodes[index]
+
+        if levels is None:
+            levels = self.levels(index)
+        node = Node(self, index, levels)
+        if self.lazy:
+            self.nodes[index] = node
+
+        return node
+
+    def levels(self, index):
+        """ Generalization level of each quasi-identifier for a node """
+        return tuple((index // stride) % radix for stride, radix in zip(self.strides, self.radices))
+
+    def levels_of(self, indices):
+        """ Matrix with the levels of a node in each row, for many nodes at once """
+        indices = np.asarray(indices, dtype=np.int64)
+        return (indices[:, None] // np.array(self.strides)) % np.array(self.radices)
+
+    def index(self, levels):
+        """ Node corresponding to a generalization level for each quasi-identifier """
+        return sum(level * stride for level, stride in zip(levels, self.strides))
+
+    def height(self, index):
+        return sum(self.levels(index))
+
+    @property
+    def heights(self):
+        """ Height of every node, i.e.: the sum of its generalization levels """
+        if self._heights is None:
+            heights = np.zeros(1, dtype=np.int32)
+            for radix in self.radices:
+                heights = (np.arange(radix, dtype=np.int32)[:, None] + heights[None, :]).ravel()
+            self._heights = heights
+
+        return self._heights
+
+    def at_height(self, height):
+        """ Indices of all the nodes at some height, looked up in an index built once """
+        if self._height_index is None:
+            order = np.argsort(self.heights, kind='stable')
+            bounds = np.searchsorted(self.heights[order], np.arange(self.top.height + 2))
+            self._height_index = order, bounds
+
+        order, bounds = self._height_index
+        if height < 0 or height > self.top.height:
+            return order[:0]
+        return order[bounds[height]:bounds[height + 1]]
+
+    def box(self, b_levels, t_levels, height=None):
+        """ Indices of the nodes between a bottom and a top node (included), only at some height if
+        specified. The box is enumerated directly, dropping partial nodes that cannot reach the height """
+        if height is not None and not self.lazy and b_levels == self.bottom.levels and t_levels == self.top.levels:
+            return self.at_height(height)
+
+        # quasi-identifiers whose level is fixed by the bounds only shift the indices
+        offset = sum(b_level * stride for b_level, stride in zip(b_levels, self.strides))
+        free = [(stride, t_level - b_level) for stride, b_level, t_level in zip(self.strides, b_levels, t_levels)
+                if t_level > b_level]
+        target = None if height is None else height - sum(b_levels)
+
+        if math.prod(span + 1 for _, span in free) <= SMALL_BOX:
+            indices = [offset + sum(l * stride for l, (stride, _) in zip(levels, free))
+                       for levels in product(*[range(span + 1) for _, span in free])
+                       if target is None or sum(levels) == target]
+            return np.array(sorted(indices), dtype=np.int64)
+
+        indices = np.full(1, offset, dtype=np.int64)
+        heights = np.zeros(1, dtype=np.int64)
+        max_rest = sum(span for _, span in free)
+        for stride, span in free:
+            max_rest -= span
+            levels = np.arange(span + 1, dtype=np.int64)
+            indices = (levels[:, None] * stride + indices[None, :]).ravel()
+            heights = (levels[:, None] + heights[None, :]).ravel()
+            if target is not None:
+                reachable = (heights <= target) & (heights + max_rest >= target)
+                indices = indices[reachable]
+                heights = heights[reachable]
+
+        return np.sort(indices)
+
+    def level(self, b_node, t_node, h):
+        """ Nodes of the sub-lattice between two nodes that are h levels above the bottom one """
+        indices = self.box(b_node.levels, t_node.levels, height=b_node.height + h)
+        return [self.node(int(i)) for i in indices]
+
+    def children(self, index):
+        return [index + stride for level, stride, max_level in zip(self.levels(index), self.strides, self.max_levels)
+                if level < max_level]
+
+    def parents(self, index):
+        return [index - stride for level, stride in zip(self.levels(index), self.strides) if level > 0]
+
+    def tag(self, index):
+        if self.lazy:
+            return self.tags.get(index, UNTAGGED)
+        return self.tags[index]
+
+    def set_tag(self, index, tag):
+        """ Tag a node and, predictively, all the untagged nodes it implies something about """
+        if self.lazy:
+            self._propagate_tag(index, tag)
+            return
 
-        t_node = b_node
-        # there is only one node in the last level
-        while len(t_node.children) > 0:
-            t_node = t_node.children[0]
+        # In the case of k-anonymity, a suitable node implies all of its generalizations are suitable and
+        # a non-suitable one that none of its specializations are. Information loss works in reverse
+        upwards = (tag == SUITABLE) == self.suitable_upwards
+        self.tags[index] = tag
+        count = 1
+        # Walk the implications one height at a time, stopping at tagged nodes: their own implications are
+        # already tagged
+        frontier = np.array([index], dtype=np.int64)
+        while len(frontier) > 0:
+            frontier = self._neighbours_of(frontier, upwards)
+            frontier = frontier[self.tags[frontier] == UNTAGGED]
+            self.tags[frontier] = tag
+            count += len(frontier)
+        self._count_tags(tag, count)
 
-        return b_node, t_node
+    def _neighbours_of(self, indices, upwards):
+        """ Distinct children (or parents) of many nodes at once """
+        neighbours = []
+        for stride, max_level in zip(self.strides, self.max_levels):
+            levels = (indices // stride) % (max_level + 1)
+            if upwards:
+                neighbours.append(indices[levels < max_level] + stride)
+            else:
+                neighbours.append(indices[levels > 0] - stride)
+
+        return np.unique(np.concatenate(neighbours))
+
+    def _count_tags(self, tag, count):
+        self.visited_nodes += count
+        if tag == SUITABLE:
+            self.num_suitable += count
+        else:
+            self.num_not_suitable += count
+
+    def _propagate_tag(self, index, tag):
+        """ Tag a node and walk its implications one neighbour at a time, touching only the nodes it tags """
+        if tag == SUITABLE:
+            # In the case of k-anonymity, if a node is suitable so will all of its children
+            # Information loss works in reverse
+            neighbours = self.children if self.suitable_upwards else self.parents
+        else:
+            # In the case of k-anonymity, if a node is not suitable nor will all of its parents
+            # Information loss works in reverse
+            neighbours = self.parents if self.suitable_upwards else self.children
+
+        stack = [index]
+        while len(stack) > 0:
+            i = stack.pop()
+            if self.tag(i) != UNTAGGED and i != index:
+                continue
+            self.tags[i] = tag
+            self._count_tags(tag, 1)
+            stack.extend(n for n in neighbours(i) if self.tag(n) == UNTAGGED)
+
+
+class Node():
+    """ Lightweight view of a node of a Lattice, identified by its index """
+    __slots__ = ('root', 'index', 'levels', '_children', '_parents')
+
+    def __init__(self, root, index, levels):
+        self.root = root
+        self.index = index
+        self.levels = levels
+        self._children = None
+        self._parents = None
+
+    @classmethod
+    def build_network(cls, rules, records, suitable_check, suitable_upwards=True, logger=None, lazy=False):
+        lattice = Lattice(rules, records, suitable_check, suitable_upwards=suitable_upwards, logger=logger,
+            lazy=lazy)
+
+        return lattice.bottom, lattice.top
 
     def __repr__(self):
         state = self.gen_state.__repr__()
-        if self.root == self:
+        if self.is_root:
             return 'ROOT node{}'.format(state)
         else:
             return 'node{}'.format(state)
 
-    def set_logger(self, logger):
-        self.root.print = logger.print
-
-    def make_children(self):
-        for qi, level in self.gen_state.items():
-            if level < self.root.rules[qi].max_level:
-                new_state = copy.deepcopy(self.gen_state)
-                new_state[qi] = level + 1
-                tuple_new_state = tuple(new_state.items())
-                if tuple_new_state not in self.root.all_states.keys():
-                    child = Node(new_state, self.root)
-                    child.parents.append(self)
-                    self.root.all_states[tuple_new_state] = child
-                    self.children.append(child)
-                    child.make_children()
-                else:
-                    child = self.root.all_states[tuple_new_state]
-                    self.children.append(child)
-                    child.parents.append(self)
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.root is other.root and self.index == other.index
+
+    def __hash__(self):
+        return hash(self.index)
+
+    @property
+    def gen_state(self):
+        return {qi: level for qi, level in zip(self.root.qis, self.levels)}
+
+    @property
+    def height(self):
+        return sum(self.levels)
+
+    @property
+    def children(self):
+        if self._children is None:
+            root = self.root
+            self._children = []
+            for d, (level, max_level) in enumerate(zip(self.levels, root.max_levels)):
+                if level < max_level:
+                    levels = self.levels[:d] + (level + 1,) + self.levels[d+1:]
+                    self._children.append(root.node(self.index + root.strides[d], levels))
+        return self._children
+
+    @property
+    def parents(self):
+        if self._parents is None:
+            root = self.root
+            self._parents = []
+            for d, level in enumerate(self.levels):
+                if level > 0:
+                    levels = self.levels[:d] + (level - 1,) + self.levels[d+1:]
+                    self._parents.append(root.node(self.index - root.strides[d], levels))
+        return self._parents
 
     def is_in_path(self, b_node, t_node, not_root=False):
         if not_root and self == b_node:
             return False
 
-        for qi, level in self.gen_state.items():
-            if level < b_node.gen_state[qi] or level > t_node.gen_state[qi]:
+        for level, b_level, t_level in zip(self.levels, b_node.levels, t_node.levels):
+            if level < b_level or level > t_level:
                 return False
 
         return True
@@ -79,73 +306,100 @@ class Node():
         return node.is_in_path(self, self.leaf, not_root=True)
 
     def set_suitable(self):
-        self._suitable_tag = True
-        self.root.visited_nodes += 1
-        self.root.num_suitable += 1
-        # In the case of k-anonymity, if a node is suitable so will all of its children
-        # Information loss works in reverse
-        propagate = self.children if self.root.suitable_upwards else self.parents
-        for c in propagate:
-            if c.suitable_tag == None:
-                c.set_suitable()
+        self.root.set_tag(self.index, SUITABLE)
 
     def set_non_suitable(self):
-        self._suitable_tag = False
-        self.root.visited_nodes += 1
-        self.root.num_not_suitable += 1
-        # In the case of k-anonymity, if a node is not suitable nor will all of its parents
-        # Information loss works in reverse
-        propagate = self.parents if self.root.suitable_upwards else self.children
-        for p in propagate:
-            if p.suitable_tag == None:
-                p.set_non_suitable()
-    
+        self.root.set_tag(self.index, NOT_SUITABLE)
+
     @property
     def leaf(self):
-        if len(self.children) == 0:
-            return self
-        else:
-            return self.children[0].leaf
+        return self.root.top
 
     @property
     def suitable_tag(self):
-        return(self._suitable_tag)
+        tag = self.root.tag(self.index)
+        if tag == UNTAGGED:
+            return None
+        return bool(tag)
 
     @property
     def is_root(self):
-        return self.root == self
+        return self.index == 0
 
     def is_suitable(self, value, max_sup=None):
         self.root.checked_nodes += 1
         self.root.print('Trying strategy {}'.format(self))
-        self.root.print('Simulating release')
-        release = self.apply_gen()
         if max_sup is None:
-            return self.root.suitable_check['compute'](release, self, value)
-        return self.root.suitable_check['compute'](release, self, value, max_sup)        
+            return self.root.suitable_check['compute'](self, value)
+        return self.root.suitable_check['compute'](self, value, max_sup)
+
+    def class_sizes(self):
+        return self.root.dataset.class_sizes(self.gen_state)
 
     def apply_gen(self):
-        # return data_transform.apply_gen(self.root.records, self.gen_state, self.root.rules)
-        gen_records = copy.deepcopy(self.root.records)
-        for r in gen_records:
-            for col, gen_level in self.gen_state.items():
-                r[col] = self.root.rules[col].apply(r[col], gen_level)
+        return self.root.dataset.decode(self.gen_state)
+
+    def project(self):
+        """ Generalized records reduced to their quasi-identifiers """
+        return self.root.dataset.project(self.gen_state)
+
+
+class Frontier():
+    """ Antichain of nodes of a lattice, e.g.: the k-minimal nodes found so far. Adding a node drops the members
+    that are generalizations of it (specializations if not upwards). The levels of the members are kept in a
+    matrix, so that a node is compared to all of them at once """
+    def __init__(self, upwards=True):
+        self.upwards = upwards
+        self.nodes = []
+        self.indices = set()
+        self._levels = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __contains__(self, node):
+        return node.index in self.indices
+
+    def dominated(self, node):
+        """ Mask of the members that adding a node would drop """
+        if len(self.nodes) == 0:
+            return np.zeros(0, dtype=bool)
+
+        members = self._levels[:len(self.nodes)]
+        levels = np.array(node.levels)
+        if self.upwards:
+            dominated = (members >= levels).all(axis=1)
+        else:
+            dominated = (members <= levels).all(axis=1)
+        return dominated & (members != levels).any(axis=1)
+
+    def add(self, node):
+        if node.index in self.indices:
+            return
+
+        dominated = self.dominated(node)
+        if dominated.any():
+            kept = np.flatnonzero(~dominated)
+            self.indices.difference_update(self.nodes[i].index for i in np.flatnonzero(dominated))
+            self.nodes = [self.nodes[i] for i in kept]
+            self._levels[:len(kept)] = self._levels[kept]
+
+        if self._levels is None:
+            self._levels = np.empty((16, len(node.levels)), dtype=np.int32)
+        elif len(self.nodes) == len(self._levels):
+            self._levels = np.concatenate([self._levels, np.empty_like(self._levels)])
+        self._levels[len(self.nodes)] = node.levels
+        self.nodes.append(node)
+        self.indices.add(node.index)
+
 
-        return gen_records
-        
+def depth(b_node, t_node):
+    """ Number of levels in the sub-lattice between two nodes """
+    return t_node.height - b_node.height + 1
 
 
 def make(b_node, t_node):
-    lattice = [[b_node]]
-
-    while True:
-        prev_level = lattice[-1]
-        this_level = set()
-        for node in prev_level:
-            for child in node.children:
-                if child.is_in_path(b_node, t_node):
-                    this_level.add(child)
-        lattice.append(list(this_level))
-
-        if len(lattice[-1]) == 1 and lattice[-1][0] == t_node:
-            return lattice
\ No newline at end of file
+    return [b_node.root.level(b_node, t_node, h) for h in range(depth(b_node, t_node))]
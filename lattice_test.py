@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+import lattice
+import quasi_identifiers as qi
+
+rules = {
+    0: qi.generalize_age_rule,                      # 4 levels
+    2: qi.adult_generalize_education_rule,          # 3 levels
+    5: qi.generalize_gender_rule,                   # 2 levels
+}
+
+def make_lattice(suitable_upwards=True, lazy=False):
+    return lattice.Lattice(rules, [], None, suitable_upwards=suitable_upwards, lazy=lazy)
+
+class TestLattice(unittest.TestCase):
+    def test_size(self):
+        l = make_lattice()
+        self.assertEqual(l.size, 4 * 3 * 2)
+        self.assertEqual(l.bottom.gen_state, {0: 0, 2: 0, 5: 0})
+        self.assertEqual(l.top.gen_state, {0: 3, 2: 2, 5: 1})
+
+    def test_index_round_trip(self):
+        l = make_lattice()
+        for i in range(l.size):
+            self.assertEqual(l.index(l.levels(i)), i)
+
+    def test_neighbours(self):
+        l = make_lattice()
+        node = l.node(l.index((1, 2, 0)))
+        self.assertEqual(sorted(c.levels for c in node.children), [(1, 2, 1), (2, 2, 0)])
+        self.assertEqual(sorted(p.levels for p in node.parents), [(0, 2, 0), (1, 1, 0)])
+        self.assertEqual(node.height, 3)
+
+    def test_has_descendant(self):
+        l = make_lattice()
+        node = l.node(l.index((1, 1, 0)))
+        self.assertTrue(node.has_descendant(l.node(l.index((1, 2, 1)))))
+        self.assertFalse(node.has_descendant(l.node(l.index((0, 2, 1)))))
+        self.assertFalse(node.has_descendant(node))
+
+    def test_set_suitable(self):
+        l = make_lattice()
+        node = l.node(l.index((2, 1, 0)))
+        node.set_suitable()
+        # (2..3) x (1..2) x (0..1)
+        self.assertEqual(l.num_suitable, 8)
+        self.assertEqual(l.visited_nodes, 8)
+        self.assertTrue(l.top.suitable_tag)
+        self.assertIsNone(l.node(l.index((1, 2, 1))).suitable_tag)
+
+    def test_set_non_suitable_reversed(self):
+        l = make_lattice(suitable_upwards=False)
+        node = l.node(l.index((2, 1, 0)))
+        node.set_non_suitable()
+        # (2..3) x (1..2) x (0..1)
+        self.assertEqual(l.num_not_suitable, 8)
+        node = l.node(l.index((1, 0, 1)))
+        node.set_non_suitable()
+        self.assertEqual(l.num_not_suitable, 8 + 9 - 4)
+        self.assertFalse(l.top.suitable_tag)
+
+    def test_lazy(self):
+        l = make_lattice(lazy=True)
+        self.assertEqual(len(l.nodes), 2)
+        node = l.node(l.index((2, 1, 0)))
+        self.assertIs(node.children[0], l.node(l.index((3, 1, 0))))
+        node.set_suitable()
+        self.assertEqual(l.num_suitable, 8)
+        self.assertEqual(len(l.tags), 8)
+        self.assertIsNone(l.node(l.index((1, 2, 1))).suitable_tag)
+
+    def test_dense_matches_lazy(self):
+        for suitable_upwards in (True, False):
+            dense = make_lattice(suitable_upwards=suitable_upwards)
+            lazy = make_lattice(suitable_upwards=suitable_upwards, lazy=True)
+            for levels, suitable in [((1, 1, 0), True), ((2, 0, 1), False), ((0, 2, 0), True), ((3, 0, 0), False)]:
+                for l in (dense, lazy):
+                    node = l.node(l.index(levels))
+                    if node.suitable_tag is None:
+                        node.set_suitable() if suitable else node.set_non_suitable()
+            # tagging a node again counts it once more in both modes
+            for l in (dense, lazy):
+                l.node(l.index((3, 2, 1))).set_suitable()
+            self.assertEqual([dense.tag(i) for i in range(dense.size)], [lazy.tag(i) for i in range(lazy.size)])
+            self.assertEqual(dense.visited_nodes, lazy.visited_nodes)
+            self.assertEqual(dense.num_suitable, lazy.num_suitable)
+            self.assertEqual(dense.num_not_suitable, lazy.num_not_suitable)
+
+    def test_box(self):
+        for small_box in (lattice.SMALL_BOX, 0):
+            with mock.patch.object(lattice, 'SMALL_BOX', small_box):
+                for lazy in (False, True):
+                    l = make_lattice(lazy=lazy)
+                    b_levels, t_levels = (1, 0, 0), (3, 1, 1)
+                    for height in [None] + list(range(7)):
+                        expected = [i for i in range(l.size)
+                            if all(b <= lvl <= t for lvl, b, t in zip(l.levels(i), b_levels, t_levels))
+                            and (height is None or l.height(i) == height)]
+                        self.assertEqual(list(l.box(b_levels, t_levels, height=height)), expected)
+
+    def test_at_height(self):
+        l = make_lattice()
+        for height in range(l.top.height + 1):
+            expected = [i for i in range(l.size) if l.height(i) == height]
+            self.assertEqual(list(l.at_height(height)), expected)
+            self.assertEqual(list(l.box(l.bottom.levels, l.top.levels, height=height)), expected)
+
+    def test_make(self):
+        l = make_lattice()
+        b_node = l.node(l.index((1, 0, 0)))
+        t_node = l.node(l.index((2, 2, 1)))
+        levels = lattice.make(b_node, t_node)
+        self.assertEqual([len(lvl) for lvl in levels], [1, 3, 4, 3, 1])
+        self.assertEqual(levels[-1], [t_node])
+
+    def test_frontier(self):
+        l = make_lattice()
+        frontier = lattice.Frontier()
+        for levels in [(3, 2, 1), (2, 1, 1), (1, 2, 0), (3, 0, 1), (1, 1, 0)]:
+            frontier.add(l.node(l.index(levels)))
+        self.assertEqual([n.levels for n in frontier], [(3, 0, 1), (1, 1, 0)])
+        frontier.add(l.node(l.index((1, 1, 0))))
+        self.assertEqual(len(frontier), 2)
+
+        frontier = lattice.Frontier(upwards=False)
+        for levels in [(0, 0, 0), (1, 1, 0), (1, 0, 1), (2, 2, 0)]:
+            frontier.add(l.node(l.index(levels)))
+        self.assertEqual([n.levels for n in frontier], [(1, 0, 1), (2, 2, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 from itertools import product
 
+import numpy as np
+
 import experiment
+import data_transform
 
 def group_release(records, ks):
     """ Split records into equivalence classes based on a list of knowledge states """
@@ -18,6 +21,31 @@ def group_release(records, ks):
 
     return result
 
+class CountedRelease():
+    """ Size of every equivalence class of records for a list of knowledge states, without keeping the records in
+    each class: the known columns of every record are packed into a single key (see data_transform.pack_keys),
+    and each state only keeps the sorted keys of its classes and the number of records in each """
+    def __init__(self, records, ks):
+        self.size = len(records)
+        self.columns = [data_transform.encode_column([r[i] for r in records]) for i in range(len(records[0]))]
+        self.classes = {state: np.unique(self.keys(state), return_counts=True) for state in ks}
+
+    def keys(self, state):
+        """ Key of the equivalence class of every record in a knowledge state """
+        known = [self.columns[i] for i, col in enumerate(state) if col]
+        if len(known) == 0:
+            return np.zeros(self.size, dtype=np.int64)
+        return data_transform.pack_keys([codes for codes, _ in known], [len(values) for _, values in known])[0]
+
+    def crowd_sizes(self, state):
+        """ Size of the equivalence class of every record in a knowledge state """
+        class_keys, counts = self.classes[state]
+        return counts[np.searchsorted(class_keys, self.keys(state))]
+
+def count_release(records, ks):
+    """ Count the records of every equivalence class based on a list of knowledge states (see group_release) """
+    return CountedRelease(records, ks)
+
 def col_values(r, ks):
     """ For a record, get only its values corresponding to known columns """
     known_col = [i for i, col in enumerate(ks) if col]
@@ -75,25 +103,16 @@ def prob_reid(release, prob_inclusion, probs_knowing_sa, gen_rules):
     each sensitive column """
     no_attributes = len(release[0])
     k_states = knowledge_states(no_attributes, list(gen_rules.keys()), list(probs_knowing_sa.keys()))
-    grouped_release = group_release(release, k_states)
+    counted_release = count_release(release, k_states)
 
-    result = 0
     probs_knowing_col = p_knowing_each_attribute(no_attributes, gen_rules, probs_knowing_sa)
 
-    for r in release:
-        summation = 0
-        terms = []
-        for k in k_states:
-            col_vals = col_values(r, k)
-            crowd = len(grouped_release[k][col_vals])
-            if crowd == 1:
-                terms.append(grouped_release[k][col_vals])
-
-            summation += p_knowledge_state(k, probs_knowing_col) * p_reid_in_state(r, prob_inclusion, grouped_release[k], k)
-        if result < summation:
-            result = summation
-        
-    result = 1/result
+    # probability of re-identifying every record, summed over the knowledge states
+    summation = np.zeros(len(release))
+    for k in k_states:
+        summation += p_knowledge_state(k, probs_knowing_col) * ((1 / counted_release.crowd_sizes(k)) * prob_inclusion)
+
+    result = 1/float(summation.max())
 
     return round(result, 4), {
         'params': {
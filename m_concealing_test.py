@@ -1,3 +1,4 @@
+import random
 import unittest
 
 import m_concealing as mc
@@ -150,5 +151,34 @@ class TestProbReid(unittest.TestCase):
 
         self.assertEqual(result, 0.23)
 
+class TestCountRelease(unittest.TestCase):
+    def test_matches_group_release(self):
+        rng = random.Random(0)
+        records = [[rng.choice(['Black', 'White']), rng.choice(['Male', 'Female']), rng.choice(['Rich', 'Poor']),
+            rng.choice(['Diabetes', 'Flu', 'None'])] for _ in range(200)]
+        ks = mc.knowledge_states(4, [0, 1], [2, 3]) + [(False, False, False, False)]
+        grouped = mc.group_release(records, ks)
+        counted = mc.count_release(records, ks)
+        for state in ks:
+            self.assertEqual(sorted(counted.classes[state][1].tolist()), sorted(len(c) for c in grouped[state].values()))
+            expected = [len(grouped[state][mc.col_values(r, state)]) for r in records]
+            self.assertEqual(counted.crowd_sizes(state).tolist(), expected)
+
+    def test_prob_reid(self):
+        rng = random.Random(1)
+        release = [[rng.choice(['Black', 'White']), rng.choice(['Male', 'Female']), rng.choice(['Rich', 'Poor']),
+            rng.randrange(20)] for _ in range(100)]
+        probs_knowing_sa = {2: 0.3, 3: 0.05}
+        gen_rules = {0: None, 1: None}
+        result, _ = mc.prob_reid(release, 0.5, probs_knowing_sa, gen_rules)
+
+        # maximum probability of re-identifying a record, from the records of every class
+        k_states = mc.knowledge_states(4, [0, 1], [2, 3])
+        grouped = mc.group_release(release, k_states)
+        probs_knowing_col = mc.p_knowing_each_attribute(4, gen_rules, probs_knowing_sa)
+        expected = max(sum(mc.p_knowledge_state(k, probs_knowing_col) * mc.p_reid_in_state(r, 0.5, grouped[k], k)
+            for k in k_states) for r in release)
+        self.assertEqual(result, round(1 / expected, 4))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,86 +1,162 @@
 import copy
 import time
 import math
+import multiprocessing
 
+import numpy as np
 from tqdm import tqdm
 
 import quasi_identifiers
 from quasi_identifiers import QuasiIdentifier
 import experiment
 import data_transform
+import flash
 import lattice
 
-def add_k_minimal(node, k_min_set):
-    """ Add node to k-minimal set, removing all higher nodes in path to leaf """
-    to_remove = []
+# Dataset of a worker process of a ParallelCheck
+_worker_dataset = None
+
+def _attach_worker(shared, gen_rules):
+    global _worker_dataset
+    _worker_dataset = data_transform.EncodedDataset.attach(shared, gen_rules)
+
+def _is_k_anonymous(task):
+    levels, k, max_sup = task
+    class_sizes = _worker_dataset.class_sizes(dict(zip(_worker_dataset.qis, levels)))
+    return data_transform.suppressed(class_sizes, k) <= max_sup
+
+
+class ParallelCheck():
+    """ Pool of processes checking the untagged nodes of a lattice level ahead of the search, one chunk of nodes
+    at a time. The workers read the quasi-identifiers from shared memory and keep their own cache of frequency
+    sets """
+    def __init__(self, dataset, processes):
+        self.size = len(dataset)
+        self.block, shared = dataset.share()
+        self.pool = multiprocessing.Pool(processes, _attach_worker, (shared, dataset.gen_rules))
+        self.chunk_size = processes
+        self.results = {}
+        self.checked_nodes = 0
+
+    def check_level(self, nodes, k, max_sup):
+        """ Check speculatively the first untagged nodes of the rest of a level, their results are used when the
+        search reaches them. Nodes tagged since they were checked are dropped from the results """
+        if len(nodes) == 0:
+            return
+        root = nodes[0].root
+        self.results = {i: suitable for i, suitable in self.results.items() if root.tag(i) == lattice.UNTAGGED}
+
+        nodes = [n for n in nodes if n.suitable_tag is None and n.index not in self.results][:self.chunk_size]
+        if len(nodes) < 2:
+            return
+
+        max_sup = int(self.size * max_sup / 100)
+        results = self.pool.map(_is_k_anonymous, [(n.levels, k, max_sup) for n in nodes])
+        self.results.update(zip((n.index for n in nodes), results))
+        self.checked_nodes += len(nodes)
+
+    def close(self):
+        self.results.clear()
+        self.pool.close()
+        self.pool.join()
+        self.block.close()
+        self.block.unlink()
+
+
+def compile_k_anonymous_check(logger=None, parallel=None):
+    if logger is not None:
+        info = logger.print
+    else:
+        info = print
 
-    for old_node in k_min_set:
-        if node.has_descendant(old_node):
-            to_remove.append(old_node)
+    def are_k_anonymous(node, k, max_sup):
+        """ Check whether records are k-anonymous for some max suppression """
+        if parallel is not None and node.index in parallel.results:
+            suitable = parallel.results.pop(node.index)
+            info('--> was k-anonymous' if suitable else '--> was not k-anonymous')
+            return suitable
+
+        max_sup = int(len(node.root.dataset) * max_sup / 100)
 
-    for doomed in to_remove:
-        k_min_set.remove(doomed)
+        info('Making equivalence classes')
+        class_sizes = node.class_sizes()
 
-    k_min_set.add(node)
+        info('Checking that all equivalence classes have size k')
+        if data_transform.suppressed(class_sizes, k) > max_sup:
+            info('--> was not k-anonymous')
+            return False
+
+        info('--> was k-anonymous')
+        return True
     
+    return {'compute': are_k_anonymous}
+
 
-def compile_k_anonymous_check(logger=None):
+def compile_histogram_check(logger=None):
+    """ Check of k-anonymity that keeps the sorted class sizes of every node it is asked about, so that any
+    k and max suppression can later be answered for that node without generalizing the records again """
     if logger is not None:
         info = logger.print
     else:
         info = print
 
-    def are_k_anonymous_dict(records, node, k, max_sup):
-        """ Check whether records are k-anonymous for some max suppression """
-        # Using simple dict instead of 'collections' library: much better space requirements for Python > 3.6
-        qi_values = lambda record: tuple([record[idx] for idx in node.root.rules.keys()])
-        eq_classes = {}
+    histograms = {}
 
-        max_sup = int(len(records) * max_sup / 100)
+    def are_k_anonymous(node, k, max_sup):
+        """ Check whether records are k-anonymous for some max suppression """
+        max_sup = int(len(node.root.dataset) * max_sup / 100)
 
-        info('Making equivalence classes')
-        for r in records:
-            qi_signature = qi_values(r)
-            if qi_signature in eq_classes.keys():
-                eq_classes[qi_signature] +=1
-            else:
-                eq_classes[qi_signature] = 1
+        if node.index not in histograms:
+            info('Making equivalence classes')
+            class_sizes = np.sort(node.class_sizes())
+            histograms[node.index] = class_sizes, np.cumsum(class_sizes)
+        class_sizes, cumulative = histograms[node.index]
 
         info('Checking that all equivalence classes have size k')
-        for val in eq_classes.values():
-            if val < k:
-                if max_sup < val:
-                    info('--> was not k-anonymous')
-                    return False
-                else:
-                    max_sup -= val
+        small = np.searchsorted(class_sizes, k)
+        if small > 0 and cumulative[small - 1] > max_sup:
+            info('--> was not k-anonymous')
+            return False
 
         info('--> was k-anonymous')
         return True
-    
-    return {'compute': are_k_anonymous_dict}
 
+    return {'compute': are_k_anonymous}
 
-def k_min(b_node, t_node, k, max_sup, k_min_set=set()):
+
+def k_min(b_node, t_node, k, max_sup, k_min_set=None, parallel=None, bound=None):
     """ Core of OLA's operation: build k-minimal set with binary search in generalization
-    strategies of lattice """
-    lattice_lvls = lattice.make(b_node, t_node)
-    h = len(lattice_lvls)
+    strategies of lattice. With a ParallelCheck, the untagged nodes of a level are checked a chunk at a
+    time ahead of the search, but their tags are still set one node at a time in the order of the level.
+    With a BranchAndBound, sub-lattices that cannot hold a node with a lower loss than the best one found
+    are skipped """
+    if k_min_set is None:
+        k_min_set = lattice.Frontier()
+    if bound is not None and bound.prunes(b_node):
+        return k_min_set
+    h = lattice.depth(b_node, t_node)
 
     if h > 2:
         # look halfway between top and bottom node
         h = math.floor(h/2)
-        for n in lattice_lvls[h]:
+        nodes = b_node.root.level(b_node, t_node, h)
+        for i, n in enumerate(nodes):
+            if parallel is not None and n.suitable_tag is None and n.index not in parallel.results:
+                # the nodes tagged by the search so far are not sent to the pool
+                parallel.check_level(nodes[i:], k, max_sup)
+
             if n.suitable_tag == True:
-                k_min(b_node, n, k, max_sup, k_min_set)
+                k_min(b_node, n, k, max_sup, k_min_set, parallel, bound)
             elif n.suitable_tag == False:
-                k_min(n, t_node, k, max_sup, k_min_set)
+                k_min(n, t_node, k, max_sup, k_min_set, parallel, bound)
             elif n.is_suitable(k, max_sup):
                 n.set_suitable()
-                k_min(b_node, n, k, max_sup, k_min_set)
+                if bound is not None:
+                    bound.offer(n)
+                k_min(b_node, n, k, max_sup, k_min_set, parallel, bound)
             else:
                 n.set_non_suitable()
-                k_min(n, t_node, k, max_sup, k_min_set)
+                k_min(n, t_node, k, max_sup, k_min_set, parallel, bound)
 
     else: # special case of a 2-node lattice
         if b_node.suitable_tag == False:
@@ -97,91 +173,165 @@ def k_min(b_node, t_node, k, max_sup, k_min_set=set()):
             n = t_node
 
         if n.suitable_tag == True:
-            add_k_minimal(n, k_min_set)
+            k_min_set.add(n)
         elif n.is_suitable(k, max_sup):
             n.set_suitable()
-            add_k_minimal(n, k_min_set)
+            k_min_set.add(n)
+        else:
+            return k_min_set
+
+        if bound is not None:
+            bound.offer(n)
 
     return k_min_set
 
 
-def make_release(records, qis, k):
-    """ Finalize release by suppressing required records and producing some stats """
-    original_size = len(records)
-    qi_values = lambda record: tuple([record[idx] for idx in qis])
+class BranchAndBound():
+    """ Lowest loss of the suitable nodes found so far. With a monotone loss, no node of a sub-lattice has a
+    lower loss than its bottom node, so a sub-lattice whose bottom is no better than the best node found can
+    be skipped """
+    def __init__(self, get_loss):
+        self.get_loss = get_loss
+        self.losses = {}
+        self.best_loss = math.inf
+        self.best_node = None
+        self.pruned = 0
 
-    eq_classes = {}
-    release = []
+    def loss(self, node):
+        if node.index not in self.losses:
+            self.losses[node.index] = self.get_loss(node)
+        return self.losses[node.index]
 
-    for r in records:
-        qi_signature = qi_values(r)
-        if qi_signature in eq_classes.keys():
-            eq_classes[qi_signature].append(r)
-        else:
-            eq_classes[qi_signature] = [r]
+    def offer(self, node):
+        if self.loss(node) < self.best_loss:
+            self.best_loss = self.loss(node)
+            self.best_node = node
+
+    def prunes(self, b_node):
+        if self.best_node is not None and self.loss(b_node) >= self.best_loss:
+            self.pruned += 1
+            return True
+        return False
 
-    sup_ec = 0
-    sup_rec = 0
-    for val in eq_classes.values():
-        if len(val) >= k:
-            release += val
-        else:
-            sup_ec += 1
-            sup_rec += len(val)
+
+def make_release(node, k):
+    """ Finalize release by suppressing required records and producing some stats """
+    dataset = node.root.dataset
+    released, class_sizes = dataset.release(node.gen_state, k)
+    release = dataset.decode(node.gen_state, rows=released)
+
+    sup_ec = int((class_sizes < k).sum())
+    sup_rec = len(dataset) - len(released)
 
     stats = {
-        'eq_classes_before_sup': len(eq_classes.keys()),
+        'eq_classes_before_sup': len(class_sizes),
         'suppressed_classes': sup_ec,
         'suppressed_records': sup_rec,
-        'perc_suppressed_records': round((sup_rec/original_size)*100, 2),
+        'perc_suppressed_records': round((sup_rec/len(dataset))*100, 2),
     }
 
     return release, stats
 
+# Searches for the k-minimal nodes of a lattice
+ENGINES = {
+    'ola': k_min,
+    'flash': flash.k_min,
+}
+
 @experiment.step('ola')
-def run(records, generalization_rules, k, max_sup, info_loss, logs=True):
-    """ Execute OLA """
+def run(records, generalization_rules, k, max_sup, info_loss, lazy=False, processes=None, engine='ola',
+        branch_and_bound=False, logs=True):
+    """ Execute OLA. A lazy lattice only keeps track of the nodes reached by the search. With more than one
+    process, the nodes of every level are checked in a pool of processes. The engine searching for the
+    k-minimal nodes is either OLA's binary search ('ola') or Flash's vertical paths ('flash'). With branch and
+    bound, OLA keeps track of the best node while searching and skips the sub-lattices that cannot improve on
+    it, which requires a monotone loss """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown search engine {engine}')
+    if engine != 'ola' and processes is not None and processes > 1:
+        raise ValueError('Only the ola engine checks nodes in parallel')
+    if branch_and_bound and (engine != 'ola' or not info_loss.monotone):
+        raise ValueError('Branch and bound needs the ola engine and a monotone loss')
+
     l = experiment.Logger(active=logs)
     l.log_step('BUILDING LATTICE')
 
-    k_anonymous_check = compile_k_anonymous_check(logger=l)
-    b_node, t_node = lattice.Node.build_network(generalization_rules, records, k_anonymous_check, logger=l)
+    dataset = data_transform.encode(records, generalization_rules)
+    parallel = None
+    if processes is not None and processes > 1:
+        parallel = ParallelCheck(dataset, processes)
+    k_anonymous_check = compile_k_anonymous_check(logger=l, parallel=parallel)
+    b_node, t_node = lattice.Node.build_network(generalization_rules, dataset, k_anonymous_check, logger=l,
+        lazy=lazy)
+
+    bound = None
+    if branch_and_bound:
+        bound = BranchAndBound(compile_loss(info_loss))
 
     l.log_step('SEARCHING LATTICE')
-    k_min_nodes = k_min(b_node, t_node, k, max_sup)
+    try:
+        if engine == 'ola':
+            k_min_nodes = k_min(b_node, t_node, k, max_sup, parallel=parallel, bound=bound)
+        else:
+            k_min_nodes = ENGINES[engine](b_node, t_node, k, max_sup)
+    finally:
+        if parallel is not None:
+            parallel.close()
 
     if len(k_min_nodes) == 0:
         # This cannot happen if, as they should, all generalization rules bring values to indistinguishability
         l.log_step('NO STRATEGY FOUND')
         return None
 
-    l.print(f"visited {b_node.visited_nodes} nodes, checked {b_node.checked_nodes} nodes")
-    l.print(f"num k {b_node.num_suitable} nodes, num not k {b_node.num_not_suitable} nodes")
+    l.print(f"visited {b_node.root.visited_nodes} nodes, checked {b_node.root.checked_nodes} nodes")
+    l.print(f"num k {b_node.root.num_suitable} nodes, num not k {b_node.root.num_not_suitable} nodes")
+    if parallel is not None:
+        l.print(f"checked {parallel.checked_nodes} nodes in {processes} processes")
 
     l.log_step('CHOOSING STRATEGY')
 
-    if not info_loss.need_generalization:
-        get_loss = lambda node: info_loss.compute(
+    if bound is not None:
+        l.print(f"skipped {bound.pruned} sub-lattices, computed the loss of {len(bound.losses)} nodes")
+        optimal_loss, optimal_node = bound.best_loss, bound.best_node
+    else:
+        get_loss = compile_loss(info_loss)
+        losses = [(get_loss(node), node) for node in k_min_nodes]
+        optimal_loss, optimal_node = min(losses, key=lambda x: x[0])
+
+    l.log_step('GENERATING RELEASE with loss {}: {}'.format(optimal_loss, optimal_node))
+    release, release_stats = make_release(optimal_node, k)
+
+    stats = make_stats(generalization_rules, k, max_sup, info_loss, optimal_loss, optimal_node, release_stats)
+
+    return [release, optimal_node.gen_state], stats
+
+
+def compile_loss(info_loss):
+    """ Information loss of the generalization of a node """
+    if info_loss.need_dataset:
+        return lambda node: info_loss.compute(
             node.root.rules,
             node.gen_state,
+            node.root.dataset,
         )
-    else:
-        get_loss = lambda node: info_loss.compute(
+
+    if not info_loss.need_generalization:
+        return lambda node: info_loss.compute(
             node.root.rules,
             node.gen_state,
-            records,
-            node.apply_gen(),
         )
 
-    losses = [(get_loss(node), node) for node in k_min_nodes]
-    optimal_loss, optimal_node = min(losses, key=lambda x: x[0])
-
-    l.log_step('GENERATING RELEASE with loss {}: {}'.format(optimal_loss, optimal_node))
-    release, release_stats = make_release(optimal_node.apply_gen(), generalization_rules.keys(), k)
-
+    return lambda node: info_loss.compute(
+        node.root.rules,
+        node.gen_state,
+        node.root.projection,
+        node.project(),
+    )
 
 
-    stats = {
+def make_stats(generalization_rules, k, max_sup, info_loss, optimal_loss, optimal_node, release_stats):
+    root = optimal_node.root
+    return {
         'params': {
             'k': k,
             'max_sup': max_sup,
@@ -193,12 +343,71 @@ def run(records, generalization_rules, k, max_sup, info_loss, logs=True):
             {
                 'info_loss': round(optimal_loss, 4),
                 'node': str(optimal_node),
-                'visited_nodes': b_node.visited_nodes,
-                'checked_nodes': b_node.checked_nodes,
-                'b_node.k_anonymous_nodes': b_node.num_suitable,
-                'b_node.not_k_anonymous_nodes': b_node.num_not_suitable,
+                'visited_nodes': root.visited_nodes,
+                'checked_nodes': root.checked_nodes,
+                'b_node.k_anonymous_nodes': root.num_suitable,
+                'b_node.not_k_anonymous_nodes': root.num_not_suitable,
             }
         )
     }
 
-    return [release, optimal_node.gen_state], stats
\ No newline at end of file
+
+def sweep(records, generalization_rules, ks, max_sups, info_losses, logs=True):
+    """ Execute OLA for every combination of k, max suppression and information loss metric, in this order.
+    The records are generalized once per node and the tags found for a combination are passed on to the
+    others: k-anonymity for some k and max suppression implies it for a smaller k or a larger max suppression,
+    and conversely. Returns the results of run for every combination, or None where no strategy was found.
+
+    The nodes tagged by previous searches are neither checked nor counted again: checked_nodes, visited_nodes
+    and the counts of (not) k-anonymous nodes only cover the search of a combination itself, and are lower
+    than in an independent run. The number of nodes tagged beforehand is reported as seeded_nodes """
+    l = experiment.Logger(active=logs)
+
+    check = compile_histogram_check(logger=l)
+    dataset = data_transform.encode(records, generalization_rules)
+    # tags of the searches done so far, by k and max suppression
+    searched = {}
+    losses = {info_loss.name: {} for info_loss in info_losses}
+    releases = {}
+
+    results = []
+    for k in ks:
+        for max_sup in max_sups:
+            l.log_step(f'SEARCHING LATTICE for k {k} and max suppression {max_sup}')
+            b_node, t_node = lattice.Node.build_network(generalization_rules, dataset, check, logger=l)
+            tags = b_node.root.tags
+            for (other_k, other_max_sup), other_tags in searched.items():
+                if other_k >= k and other_max_sup <= max_sup:
+                    tags[other_tags == lattice.SUITABLE] = lattice.SUITABLE
+                if other_k <= k and other_max_sup >= max_sup:
+                    tags[other_tags == lattice.NOT_SUITABLE] = lattice.NOT_SUITABLE
+            seeded_nodes = int((tags != lattice.UNTAGGED).sum())
+            l.print(f"{seeded_nodes} nodes tagged by previous searches")
+
+            k_min_nodes = k_min(b_node, t_node, k, max_sup)
+            searched[(k, max_sup)] = tags
+
+            for info_loss in info_losses:
+                if len(k_min_nodes) == 0:
+                    l.log_step('NO STRATEGY FOUND')
+                    results.append(None)
+                    continue
+
+                known = losses[info_loss.name]
+                get_loss = compile_loss(info_loss)
+                for node in k_min_nodes:
+                    if node.index not in known:
+                        known[node.index] = get_loss(node)
+                optimal_loss, optimal_node = min(((known[node.index], node) for node in k_min_nodes),
+                    key=lambda x: x[0])
+
+                if (optimal_node.index, k) not in releases:
+                    releases[(optimal_node.index, k)] = make_release(optimal_node, k)
+                release, release_stats = releases[(optimal_node.index, k)]
+
+                stats = make_stats(generalization_rules, k, max_sup, info_loss, optimal_loss, optimal_node,
+                    dict(release_stats))
+                stats['results']['seeded_nodes'] = seeded_nodes
+                results.append(([release, optimal_node.gen_state], stats))
+
+    return results
\ No newline at end of file
@@ -0,0 +1,81 @@
+import random
+import unittest
+
+import experiment
+import flash
+import information_loss
+import lattice
+import ola
+import quasi_identifiers as qi
+
+gen_rules = {
+    0: qi.generalize_age_rule,
+    1: qi.adult_generalize_workclass_rule,
+    2: qi.adult_generalize_marital_status_rule,
+}
+
+def make_records(n=200, seed=0):
+    rnd = random.Random(seed)
+    workclasses = ['Private', 'Self-emp-not-inc', 'Self-emp-inc', 'Federal-gov', 'Local-gov', 'State-gov']
+    statuses = ['Married-civ-spouse', 'Divorced', 'Never-married', 'Separated', 'Widowed']
+    return [[str(rnd.randint(17, 90)), rnd.choice(workclasses), rnd.choice(statuses), rnd.choice(['<=50K', '>50K'])]
+        for _ in range(n)]
+
+class TestOla(unittest.TestCase):
+    def test_sweep_matches_run(self):
+        records = make_records()
+        ks, max_sups = [10, 2], [0, 5]
+        losses = [information_loss.prec, information_loss.dm_star]
+        results = iter(ola.sweep(records, gen_rules, ks, max_sups, losses, logs=False))
+        for k in ks:
+            for max_sup in max_sups:
+                for loss in losses:
+                    [release, _], stats = ola.run(records, gen_rules, k, max_sup, loss, logs=False)
+                    [swept_release, _], swept_stats = next(results)
+                    self.assertEqual(swept_stats['params'], stats['params'])
+                    self.assertEqual(swept_stats['results']['info_loss'], stats['results']['info_loss'])
+                    self.assertEqual(len(swept_release), len(release))
+
+    def test_flash_finds_k_minimal_nodes(self):
+        records = make_records()
+        logger = experiment.Logger(active=False)
+        check = ola.compile_k_anonymous_check(logger=logger)
+        for k, max_sup in [(10, 0), (5, 5), (50, 1)]:
+            for lazy in (False, True):
+                b_node, t_node = lattice.Node.build_network(gen_rules, records, check, logger=logger, lazy=lazy)
+                root = b_node.root
+                suitable = [check['compute'](root.node(i), k, max_sup) for i in range(root.size)]
+                expected = [i for i in range(root.size)
+                    if suitable[i] and not any(suitable[p] for p in root.parents(i))]
+                self.assertEqual(sorted(n.index for n in flash.k_min(b_node, t_node, k, max_sup)), expected)
+
+    def test_flash_engine(self):
+        records = make_records()
+        for loss in [information_loss.prec, information_loss.dm_star]:
+            _, stats = ola.run(records, gen_rules, 10, 5, loss, logs=False)
+            _, flash_stats = ola.run(records, gen_rules, 10, 5, loss, engine='flash', logs=False)
+            self.assertEqual(flash_stats['results']['info_loss'], stats['results']['info_loss'])
+            self.assertEqual(flash_stats['results']['visited_nodes'], 4 * 3 * 3)
+
+    def test_branch_and_bound(self):
+        records = make_records()
+        for loss in [information_loss.prec, information_loss.dm_star, information_loss.entropy]:
+            for k, max_sup in [(10, 0), (5, 5)]:
+                _, stats = ola.run(records, gen_rules, k, max_sup, loss, logs=False)
+                _, bound_stats = ola.run(records, gen_rules, k, max_sup, loss, branch_and_bound=True, logs=False)
+                self.assertEqual(bound_stats['results']['info_loss'], stats['results']['info_loss'])
+
+    def test_parallel(self):
+        records = make_records()
+        for k, max_sup in [(10, 0), (5, 5), (50, 1)]:
+            [_, gen_state], stats = ola.run(records, gen_rules, k, max_sup, information_loss.prec, logs=False)
+            [_, parallel_gen_state], parallel_stats = ola.run(records, gen_rules, k, max_sup, information_loss.prec,
+                processes=2, logs=False)
+            self.assertEqual(parallel_gen_state, gen_state)
+            self.assertEqual(parallel_stats['results']['node'], stats['results']['node'])
+            self.assertEqual(parallel_stats['results']['info_loss'], stats['results']['info_loss'])
+            self.assertEqual(parallel_stats['results']['checked_nodes'], stats['results']['checked_nodes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,6 @@
 import time
 import os
 
-from tqdm import tqdm
-
 import ola
 import quasi_identifiers
 import information_loss
@@ -33,12 +31,10 @@ def make_data_points():
     max_sups = [0, 1, 5, 10, 20, 50]
     losses = [information_loss.prec, information_loss.dm_star, information_loss.entropy]
     
-    c = 0
-    for k in tqdm(ks):
-        for sup in tqdm(max_sups):
-            for loss in tqdm(losses):
-                [release, gen], ola_stats = ola.run(records, gen_rules, k=k, max_sup=sup, info_loss=loss, logs=False)
-                experiment.publish_stats(ola_stats, experiment_root)
+    for result in ola.sweep(records, gen_rules, ks, max_sups, losses, logs=False):
+        if result is not None:
+            [release, gen], ola_stats = result
+            experiment.publish_stats(ola_stats, experiment_root)
 
 
 def make_graph():
@@ -93,6 +89,8 @@ def make_heatmap():
     fig = plt.figure()
 
 
+    # The data points come from ola.sweep: the nodes tagged by the searches for other k and max suppression
+    # (results.seeded_nodes) are not checked again, so these are fewer checked nodes than independent runs
     checked = experiment.look_for_stats(experiment_root, params={'loss_metric': 'Prec'})
     checked = experiment.filter_many_stats(checked, params=['k', 'max_sup'], results=['checked_nodes'])
     checked = {
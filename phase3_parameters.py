@@ -21,3 +21,11 @@ for i, beta in enumerate(betas):
             else:
                 points[beta] = [(eps,eps_prime)]
             print(f'beta {beta} \t epsilon {np.round(eps, 5)} \t\t epsilon_prime {eps_prime} \t {delta<10e-4} ')
+
+
+# Frontier of the configurations with delta below 10e-4, on a dense grid of betas
+by_beta, by_epsilon = epsilon_safe.frontier(25, len(records), 10e-4, np.linspace(0.01, 0.99, 99), epsilon)
+for beta, delta, min_epsilon, feasible in by_beta[by_beta['feasible']]:
+    print(f'beta {np.round(beta, 2)} \t delta {delta} \t epsilon > {np.round(min_epsilon, 5)}')
+for eps, beta, delta in by_epsilon:
+    print(f'epsilon {eps} \t max beta {beta} \t delta {delta}')
@@ -8,6 +8,7 @@ import epsilon_safe_ola as ela
 import epsilon_safe as es
 import quasi_identifiers
 import information_loss
+import data_transform
 from dataset import adult
 import experiment
 
@@ -26,39 +27,52 @@ gen_rules = {
     # 13: quasi_identifiers.adult_generalize_country_rule
 }
 
+# all the quasi-identifiers of Adult, too many nodes to evaluate the whole lattice (see sample_full_lattice)
+full_gen_rules = {
+    0: quasi_identifiers.generalize_age_rule,
+    1: quasi_identifiers.adult_generalize_workclass_rule,
+    3: quasi_identifiers.adult_generalize_education_rule,
+    5: quasi_identifiers.adult_generalize_marital_status_rule,
+    6: quasi_identifiers.adult_generalize_occupation_rule,
+    7: quasi_identifiers.suppress_rule,
+    8: quasi_identifiers.suppress_rule,
+    9: quasi_identifiers.suppress_rule,
+    13: quasi_identifiers.adult_generalize_country_rule
+}
+
 records = adult.retrieve()
 draws_file = os.path.join(experiment_root, 'draws.pickle')
 lattice_file = os.path.join(experiment_root, 'lattice.pickle')
 betas = [0.05, 0.25, 0.45, 0.75]
 
 def draw_from_adult():
+    """ Draw samples of the records, stored as bit arrays of the records included in every sample """
     all_draws = {}
     for beta in betas:
-        all_draws[beta] = []
-        for i in range(10):
-            experiments = np.random.binomial(1, beta, len(records))
-            draw = [r for j, r in enumerate(records) if experiments[j] == 1]
-            all_draws[beta].append(draw)
+        masks = np.random.binomial(1, beta, (10, len(records)))
+        all_draws[beta] = data_transform.pack_masks(masks)
 
 
         with open(draws_file, 'wb') as handle:
             pickle.dump(all_draws, handle)
 
 
-
-def build_rich_lattice():
+def load_draws(beta):
+    """ Samples of the records as a boolean matrix of samples x records """
     with open(draws_file, 'rb') as handle:
         all_draws = pickle.load(handle)
 
+    return data_transform.unpack_masks(*all_draws[beta])
+
+
+
+def build_rich_lattice():
     k = 50
     max_sup = 5
 
-    lattices = []
-
     beta = 0.75
-    for input_draw in all_draws[beta]:
-        lattice, _ = ela.run(input_draw, gen_rules, k=k, max_sup=max_sup, logs=False)
-        lattices.append(lattice)
+    # the lattices of all the draws are evaluated at once, one row per draw
+    lattices, _ = ela.run(records, gen_rules, k=k, max_sup=max_sup, masks=load_draws(beta), logs=False)
 
 
     with open(lattice_file, 'wb') as handle:
@@ -69,109 +83,61 @@ def make_data_points():
     with open(lattice_file, 'rb') as handle:
         lattices = pickle.load(handle)
     
-    with open(draws_file, 'rb') as handle:
-        draws = pickle.load(handle)[0.75]
-
-    penalties = [0.002, 0.005, 0.01, 0.02, 0.025, 0.04, 0.05, 0.1, 0.2, 0.5]
-    epsilons = [0.01, 0.05, 0.1, 0.5]
+    # only the size of the draws matters here
+    draw_sizes = load_draws(0.75).sum(axis=1)
 
     n = 0
 
-        
-    for epsilon in epsilons:
-        for penalty in penalties:
-            n += 1
-            avg_average_info_loss = experiment.AverageMeter()
-            avg_average_suppression = experiment.AverageMeter()
-            avg_baseline_suppression = experiment.AverageMeter()
-            avg_good_nodes = experiment.AverageMeter()
-            avg_baseline_good_nodes = experiment.AverageMeter()
-            avg_min_suppression = experiment.AverageMeter()
-            avg_max_suppression = experiment.AverageMeter()
-
-
-            for l, d in zip(lattices, draws):
-                sensitivity = penalty * (100 / len(d))
-                nodes = es.compute_utility(l, epsilon, penalty, len(d), sensitivity, 'suppression', gen_rules)
-                probs = [(n['p']) for n in nodes]
-                average_info_loss, min_suppression, max_suppression, average_suppression, suppression_baseline, good_nodes, good_nodes_baseline = es.output_stats(nodes, max_sup=5, max_info_loss=0.5)
-                avg_average_info_loss.add(average_info_loss)
-                avg_average_suppression.add(average_suppression)
-                avg_baseline_suppression.add(suppression_baseline)
-                avg_good_nodes.add(good_nodes)
-                avg_baseline_good_nodes.add(good_nodes_baseline)
-                avg_min_suppression.add(min_suppression)
-                avg_max_suppression.add(max_suppression)
-
-            
-            stats = {
-                'params': {
-                    'mode': 'suppression',
-                    'penalty': penalty,
-                    'epsilon\'': epsilon,
-                },
-                'results': {
-                    'avg_info_loss': avg_average_info_loss.get(),
-                    'min_suppression': avg_min_suppression.get(),
-                    'max_suppression': avg_max_suppression.get(),
-                    'avg_suppression': avg_average_suppression.get(),
-                    'uniform_suppression': avg_baseline_suppression.get(),
-                    'good_nodes': avg_good_nodes.get(),
-                    'uniform_good_nodes': avg_baseline_good_nodes.get()
-                }
-            }
-
-            experiment.publish_stats(stats, experiment_root, nonce=n)
+    def publish(mode, epsilons, penalties, stats):
+        nonlocal n
+        # average over the lattices of the draws
+        stats = {name: stats[name].mean(axis=-1) for name in stats.dtype.names}
+        for i, epsilon in enumerate(epsilons):
+            for j, penalty in enumerate(penalties):
+                n += 1
+                experiment.publish_stats({
+                    'params': {
+                        'mode': mode,
+                        'penalty': penalty,
+                        'epsilon\'': epsilon,
+                    },
+                    'results': {
+                        'avg_info_loss': stats['average_info_loss'][i, j],
+                        'min_suppression': stats['min_suppression'][i, j],
+                        'max_suppression': stats['max_suppression'][i, j],
+                        'avg_suppression': stats['average_suppression'][i, j],
+                        'uniform_suppression': stats['baseline_suppression'][i, j],
+                        'good_nodes': stats['good_nodes'][i, j],
+                        'uniform_good_nodes': stats['baseline_good_nodes'][i, j]
+                    }
+                }, experiment_root, nonce=n)
 
+    penalties = [0.002, 0.005, 0.01, 0.02, 0.025, 0.04, 0.05, 0.1, 0.2, 0.5]
+    epsilons = [0.01, 0.05, 0.1, 0.5]
+    sensitivities = np.outer(penalties, 100 / draw_sizes)
+    stats = es.grid_stats(lattices, epsilons, penalties, sensitivities, 'suppression', gen_rules, max_sup=5,
+        max_info_loss=0.5)
+    publish('suppression', epsilons, penalties, stats)
 
+    penalties = [0.002, 0.005, 0.01, 0.05, 0.1, 0.2, 0.5, 0.7, 0.9]
     epsilons = [0.01, 0.05, 0.1, 0.5, 1, 2]
-    for epsilon in epsilons:    
-        penalties = [0.002, 0.005, 0.01, 0.05, 0.1, 0.2, 0.5, 0.7, 0.9]
-        for penalty in penalties:
-            n += 1
-            sensitivity = penalty
-
-            avg_average_info_loss = experiment.AverageMeter()
-            avg_average_suppression = experiment.AverageMeter()
-            avg_baseline_suppression = experiment.AverageMeter()
-            avg_good_nodes = experiment.AverageMeter()
-            avg_baseline_good_nodes = experiment.AverageMeter()
-            avg_min_suppression = experiment.AverageMeter()
-            avg_max_suppression = experiment.AverageMeter()
-
-            for l, d in zip(lattices, draws):
-                nodes = es.compute_utility(l, epsilon, penalty, len(d), sensitivity, 'k_anon', gen_rules)
-                probs = [(n['p']) for n in nodes]
-                average_info_loss, min_suppression, max_suppression, average_suppression, suppression_baseline, good_nodes, good_nodes_baseline = es.output_stats(nodes, max_sup=5, max_info_loss=0.5)
-                avg_average_info_loss.add(average_info_loss)
-                avg_average_suppression.add(average_suppression)
-                avg_baseline_suppression.add(suppression_baseline)
-                avg_good_nodes.add(good_nodes)
-                avg_baseline_good_nodes.add(good_nodes_baseline)
-                avg_min_suppression.add(min_suppression)
-                avg_max_suppression.add(max_suppression)
+    sensitivities = np.array(penalties)[:, np.newaxis]
+    stats = es.grid_stats(lattices, epsilons, penalties, sensitivities, 'k_anon', gen_rules, max_sup=5,
+        max_info_loss=0.5)
+    publish('kanon', epsilons, penalties, stats)
 
-            
-            stats = {
-                'params': {
-                    'mode': 'kanon',
-                    'penalty': penalty,
-                    'epsilon\'': epsilon,
-                },
-                'results': {
-                    'avg_info_loss': avg_average_info_loss.get(),
-                    'min_suppression': avg_min_suppression.get(),
-                    'max_suppression': avg_max_suppression.get(),
-                    'avg_suppression': avg_average_suppression.get(),
-                    'uniform_suppression': avg_baseline_suppression.get(),
-                    'good_nodes': avg_good_nodes.get(),
-                    'uniform_good_nodes': avg_baseline_good_nodes.get()
-                }
-            }
-
-            experiment.publish_stats(stats, experiment_root, nonce=n)
-
-        
+
+def sample_full_lattice():
+    """ Draw nodes of the lattice of all the quasi-identifiers from the exponential mechanism, evaluating only the
+    nodes visited by the chains """
+    draw = load_draws(0.75)[0]
+    sample = [r for r, included in zip(records, draw) if included]
+
+    for epsilon in [0.01, 0.1, 1]:
+        for penalty in [0.01, 0.1, 0.5]:
+            _, stats = ela.sample(sample, full_gen_rules, k=50, max_sup=5, epsilon=epsilon, penalty_factor=penalty,
+                sensitivity=penalty, mode='k_anon', steps=2000, chains=4, burn_in=500, logs=False)
+            experiment.publish_stats(stats, os.path.join(experiment_root, 'mcmc'))
 
 
 def make_graph():
@@ -203,4 +169,5 @@ def make_graph():
 # draw_from_adult()
 # build_rich_lattice()
 # make_data_points()
+# sample_full_lattice()
 # make_graph()
\ No newline at end of file
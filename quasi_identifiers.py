@@ -1,3 +1,5 @@
+import numpy as np
+
 class QuasiIdentifier():
     def __init__(self, idx, value, gen_rule):
         self.idx = idx
@@ -19,9 +21,78 @@ class QuasiIdentifier():
 # Observation 3: 0 should be a valid generalization level
 
 class GeneralizationRule():
+    """ A generalization hierarchy. The function defining it is only evaluated once per value and level:
+    its results are compiled into a lookup table per level """
     def __init__(self, apply, max_level):
-        self.apply = apply
+        self.formula = apply
         self.max_level = max_level
+        self.tables = {}
+
+    def apply(self, value, gen_level):
+        table = self.tables.setdefault(gen_level, {})
+        try:
+            return table[value]
+        except KeyError:
+            table[value] = self.formula(value, gen_level)
+            return table[value]
+        except TypeError: # unhashable values cannot be looked up
+            return self.formula(value, gen_level)
+
+    def compile(self, values):
+        """ Fill the lookup tables of all levels for some values """
+        for gen_level in range(self.max_level + 1):
+            for value in values:
+                self.apply(value, gen_level)
+
+        return self
+
+    def code_table(self, values, gen_level):
+        """ Lookup table from codes to codes: the i-th entry is the position, in the returned domain, of the
+        generalization of the i-th value """
+        generalized = [self.apply(value, gen_level) for value in values]
+        domain = list(dict.fromkeys(generalized))
+        codes = {value: code for code, value in enumerate(domain)}
+
+        return np.array([codes[value] for value in generalized], dtype=np.int32), domain
+
+
+class IntervalRule(GeneralizationRule):
+    """ A generalization hierarchy bucketing numbers into intervals, which can generalize a whole column at
+    once. Each level is either None, to keep values as they are, or a list of (lower bound, upper bound, label)
+    bins, bounds included. The function defining the hierarchy is still used for single values """
+    def __init__(self, apply, bins):
+        super().__init__(apply, len(bins) - 1)
+        self.bins = []
+        for level_bins in bins:
+            if level_bins is None:
+                self.bins.append(None)
+            else:
+                lower, upper, labels = zip(*level_bins)
+                self.bins.append((np.array(lower, dtype=float), np.array(upper, dtype=float), list(labels)))
+
+    def generalize_column(self, values, gen_level):
+        """ Interval codes of a column of numbers (or numeric strings), with the labels they stand for """
+        values = np.asarray(values)
+        if self.bins[gen_level] is None:
+            labels, codes = np.unique(values, return_inverse=True)
+            return codes.astype(np.int32), labels.tolist()
+
+        numbers = values.astype(float)
+        lower, upper, labels = self.bins[gen_level]
+        codes = np.minimum(np.searchsorted(upper, numbers, side='left'), len(upper) - 1)
+        # NaN is in no bin, but compares false with every bound
+        outside = (numbers < lower[codes]) | (numbers > upper[codes]) | np.isnan(numbers)
+        if outside.any():
+            raise ValueError(values[outside][0], gen_level)
+
+        return codes.astype(np.int32), labels
+
+    def render(self, codes, labels):
+        """ Materialize the values of some interval codes """
+        return [labels[c] for c in codes]
+
+    def code_table(self, values, gen_level):
+        return self.generalize_column(values, gen_level)
 
 def generalize_gender(value, gen_level):
     if gen_level == 0 and (value == 'Male' or value == 'Female' or value == 'Other'):
@@ -34,6 +105,9 @@ def generalize_gender(value, gen_level):
 generalize_gender_rule = GeneralizationRule(generalize_gender, 1)
 
 
+# AGE_RANGES = [1, 5, 10, 20, 50, 130]
+AGE_RANGES = [1, 10, 50, 130]
+
 def generalize_age(value, gen_level):
     if isinstance(value, str):
         value = int(value)
@@ -43,8 +117,7 @@ def generalize_age(value, gen_level):
     if value[0] > value[1]: raise ValueError
 
     ages = range(130)
-    # range_per_gen_level = [1, 5, 10, 20, 50, 130]
-    range_per_gen_level = [1, 10, 50, 130]
+    range_per_gen_level = AGE_RANGES
 
     if gen_level > len(range_per_gen_level)-1: raise ValueError
 
@@ -57,7 +130,14 @@ def generalize_age(value, gen_level):
     
     raise ValueError(value, gen_level)
 
-generalize_age_rule = GeneralizationRule(generalize_age, 3)
+def age_bins(width):
+    """ Intervals of ages generalize_age maps to at some width """
+    ages = range(130)
+    a = range(0, ages[-2], width)
+    b = range(width-1, ages[-1]+1, width)
+    return [(lo, hi, (lo, hi)) for lo, hi in zip(a, b)]
+
+generalize_age_rule = IntervalRule(generalize_age, [age_bins(width) for width in AGE_RANGES])
 
 
 def adult_generalize_country(value, gen_level):
@@ -267,7 +347,11 @@ def mimic_generalize_dob(value, gen_level):
 
     raise ValueError(value, gen_level)
 
-mimic_generalize_dob_rule = GeneralizationRule(mimic_generalize_dob, 2)
+mimic_generalize_dob_rule = IntervalRule(mimic_generalize_dob, [
+    None,
+    [(-np.inf, 1950, 'quite old'), (1950, 1980, 'a bit old'), (1980, 2000, 'young'), (2000, np.inf, 'very young')],
+    [(-np.inf, np.inf, 'dob')],
+])
 
 def mimic_generalize_proc(value, gen_level):
     if gen_level == 0:
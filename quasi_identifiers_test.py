@@ -0,0 +1,57 @@
+import unittest
+
+import quasi_identifiers as qi
+
+class TestGeneralizationRule(unittest.TestCase):
+    def test_apply(self):
+        rule = qi.GeneralizationRule(qi.adult_generalize_education, 2)
+        for value in ['Bachelors', '9th', 'Preschool', '?']:
+            for gen_level in range(3):
+                self.assertEqual(rule.apply(value, gen_level), qi.adult_generalize_education(value, gen_level))
+        self.assertEqual(rule.tables[1]['9th'], 'High-School')
+
+    def test_apply_invalid(self):
+        rule = qi.GeneralizationRule(qi.generalize_gender, 1)
+        with self.assertRaises(ValueError):
+            rule.apply('Robot', 1)
+
+    def test_code_table(self):
+        rule = qi.GeneralizationRule(qi.adult_generalize_marital_status, 2)
+        values = ['Divorced', 'Never-married', 'Widowed', 'Married-AF-spouse']
+        codes, domain = rule.code_table(values, 1)
+        self.assertEqual(domain, ['Had-Spouse', 'No-Spouse', 'Has-Spouse'])
+        self.assertEqual(list(codes), [0, 1, 0, 2])
+
+
+class TestIntervalRule(unittest.TestCase):
+    def test_age_matches_formula(self):
+        rule = qi.generalize_age_rule
+        for gen_level, max_age in enumerate([127, 129, 99, 129]):
+            ages = [str(age) for age in range(max_age + 1)]
+            codes, labels = rule.generalize_column(ages, gen_level)
+            self.assertEqual(rule.render(codes, labels), [qi.generalize_age(age, gen_level) for age in ages])
+
+    def test_age_out_of_range(self):
+        with self.assertRaises(ValueError):
+            qi.generalize_age_rule.generalize_column(['30', '105'], 2)
+
+    def test_dob_matches_formula(self):
+        rule = qi.mimic_generalize_dob_rule
+        dobs = [1930.0, 1950.0, 1951.0, 1980.0, 1999.0, 2000.0, 2012.0, 1950.0]
+        for gen_level in range(3):
+            codes, labels = rule.generalize_column(dobs, gen_level)
+            self.assertEqual(rule.render(codes, labels), [qi.mimic_generalize_dob(dob, gen_level) for dob in dobs])
+        codes, labels = rule.generalize_column(dobs, 0)
+        self.assertEqual(len(labels), 7)
+
+
+    def test_dob_missing(self):
+        rule = qi.mimic_generalize_dob_rule
+        with self.assertRaises(ValueError):
+            qi.mimic_generalize_dob(float('nan'), 1)
+        with self.assertRaises(ValueError):
+            rule.generalize_column([1930.0, float('nan')], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()